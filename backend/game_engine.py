@@ -0,0 +1,205 @@
+"""Turn-based mini-games on bitboards.
+
+Each game keeps one integer per player with a bit set for every cell that
+player owns. Placing a piece sets one bit and checking for a win is a few
+AND/shift operations against masks computed once at import, so evaluating a
+move costs the same however long the game has run.
+
+The persisted state stays a plain dict: `board` (a list of symbols, for
+clients), `turn` (the user id to move next), `history` and the engine's own
+`bitboards`. Game types register themselves in GAME_TYPES by name.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Dict, List
+
+
+class GameError(ValueError):
+    """A move that the rules do not allow"""
+
+
+class GameType(ABC):
+    name = ""
+    symbols = ("X", "O")
+    cells = 0
+
+    @property
+    def players(self) -> int:
+        return len(self.symbols)
+
+    def new_state(self, player_ids: List[str]) -> dict:
+        return {"board": [None] * self.cells, "turn": player_ids[0], "history": [], "bitboards": [0] * self.players}
+
+    @abstractmethod
+    def place(self, bitboards: List[int], move: dict) -> int:
+        """Validate a move against the occupied cells; returns its bit index"""
+
+    def board_index(self, bit: int) -> int:
+        """Position in the client-facing `board` list for a bit index"""
+        return bit
+
+    @abstractmethod
+    def wins(self, bitboard: int, bit: int) -> bool:
+        """Whether the bit just played completes a line for its owner"""
+
+    @abstractmethod
+    def is_full(self, occupied: int) -> bool:
+        """Whether no further move is possible"""
+
+    def playable_bits(self) -> range:
+        return range(self.cells)
+
+    def load(self, state: dict, player_ids: List[str]) -> List[int]:
+        """The state's bitboards, rebuilt from `board` for games saved before the engine"""
+        if "bitboards" in state:
+            return state["bitboards"]
+        bitboards = [0] * self.players
+        for bit in self.playable_bits():
+            symbol = state["board"][self.board_index(bit)]
+            if symbol in self.symbols:
+                bitboards[self.symbols.index(symbol)] |= 1 << bit
+        state["bitboards"] = bitboards
+        state["turn"] = player_ids[sum(bin(b).count("1") for b in bitboards) % self.players]
+        return bitboards
+
+    def play(self, state: dict, player_ids: List[str], user_id: str, move: dict) -> dict:
+        """Apply a move to `state` in place; returns what happened"""
+        if state.get("finished"):
+            raise GameError("Game is over")
+        if user_id not in player_ids:
+            raise GameError("Not a player in this game")
+        bitboards = self.load(state, player_ids)
+        if state["turn"] != user_id:
+            raise GameError("Not your turn")
+        player = player_ids.index(user_id)
+        bit = self.place(bitboards, move)
+        bitboards[player] |= 1 << bit
+
+        cell = self.board_index(bit)
+        symbol = self.symbols[player]
+        state["board"][cell] = symbol
+        entry = {"player": user_id, "cell": cell, "symbol": symbol}
+        state["history"].append(entry)
+
+        winner = user_id if self.wins(bitboards[player], bit) else None
+        finished = winner is not None or self.is_full(sum(bitboards))
+        state["turn"] = None if finished else player_ids[(player + 1) % self.players]
+        state["finished"] = finished
+        return {"move": entry, "winner": winner, "completed": finished, "turn": state["turn"]}
+
+
+GAME_TYPES: Dict[str, GameType] = {}
+
+
+def register(cls):
+    GAME_TYPES[cls.name] = cls()
+    return cls
+
+
+def get_game_type(name: str) -> GameType:
+    game_type = GAME_TYPES.get(name)
+    if game_type is None:
+        raise GameError(f"Unknown game type: {name}")
+    return game_type
+
+
+def _lines(*lines) -> tuple:
+    return tuple(sum(1 << cell for cell in line) for line in lines)
+
+
+def _win_masks(lines: tuple, cells: int) -> tuple:
+    # Only the lines through the cell just played can have been completed
+    return tuple(tuple(line for line in lines if line >> cell & 1) for cell in range(cells))
+
+
+def _column_masks(width: int, height: int) -> tuple:
+    return tuple(((1 << height) - 1) << (column * (height + 1)) for column in range(width))
+
+
+@register
+class TicTacToe(GameType):
+    """3x3, cells numbered 0-8 row by row; move: {"cell": n}"""
+
+    name = "tictactoe"
+    cells = 9
+    FULL = (1 << 9) - 1
+    WIN_MASKS = _win_masks(_lines((0, 1, 2), (3, 4, 5), (6, 7, 8), (0, 3, 6), (1, 4, 7), (2, 5, 8), (0, 4, 8), (2, 4, 6)), 9)
+
+    def place(self, bitboards: List[int], move: dict) -> int:
+        cell = move.get("cell")
+        if isinstance(cell, bool) or not isinstance(cell, int) or not 0 <= cell < self.cells:
+            raise GameError("Invalid cell")
+        if (bitboards[0] | bitboards[1]) >> cell & 1:
+            raise GameError("Cell not empty")
+        return cell
+
+    def wins(self, bitboard: int, bit: int) -> bool:
+        for mask in self.WIN_MASKS[bit]:
+            if bitboard & mask == mask:
+                return True
+        return False
+
+    def is_full(self, occupied: int) -> bool:
+        return occupied == self.FULL
+
+
+@register
+class ConnectFour(GameType):
+    """7 columns x 6 rows; move: {"column": n}.
+
+    Bits run up each column with one spare bit on top, so shifting by 1, 7,
+    6 and 8 steps vertically, horizontally and along both diagonals without
+    wrapping. `board` is row-major from the top row, as it is drawn.
+    """
+
+    name = "connect4"
+    WIDTH, HEIGHT = 7, 6
+    STRIDE = HEIGHT + 1
+    cells = WIDTH * STRIDE  # bit space, including the spare row
+    COLUMN_MASKS = _column_masks(WIDTH, HEIGHT)
+    FULL = sum(COLUMN_MASKS)
+    DIRECTIONS = (1, STRIDE, STRIDE - 1, STRIDE + 1)
+
+    def new_state(self, player_ids: List[str]) -> dict:
+        state = super().new_state(player_ids)
+        state["board"] = [None] * (self.WIDTH * self.HEIGHT)
+        return state
+
+    def board_index(self, bit: int) -> int:
+        column, row = divmod(bit, self.STRIDE)
+        return (self.HEIGHT - 1 - row) * self.WIDTH + column
+
+    def playable_bits(self) -> list:
+        return [bit for bit in range(self.cells) if bit % self.STRIDE < self.HEIGHT]
+
+    def place(self, bitboards: List[int], move: dict) -> int:
+        column = move.get("column")
+        if isinstance(column, bool) or not isinstance(column, int) or not 0 <= column < self.WIDTH:
+            raise GameError("Invalid column")
+        filled = (bitboards[0] | bitboards[1]) & self.COLUMN_MASKS[column]
+        # The column fills from the bottom: the lowest free bit is filled + 1 in column units
+        bit = (filled + (1 << (column * self.STRIDE))).bit_length() - 1
+        if not self.COLUMN_MASKS[column] >> bit & 1:
+            raise GameError("Column is full")
+        return bit
+
+    def wins(self, bitboard: int, bit: int) -> bool:
+        for shift in self.DIRECTIONS:
+            pairs = bitboard & (bitboard >> shift)
+            if pairs & (pairs >> (2 * shift)):
+                return True
+        return False
+
+    def is_full(self, occupied: int) -> bool:
+        return occupied == self.FULL
+
+
+def new_state(game_type: str, player_ids: List[str]) -> dict:
+    engine = get_game_type(game_type)
+    if len(player_ids) != engine.players or len(set(player_ids)) != engine.players:
+        raise GameError(f"{game_type} needs {engine.players} distinct players")
+    return engine.new_state(player_ids)
+
+
+def play(game_type: str, state: dict, player_ids: List[str], user_id: str, move: dict) -> dict:
+    return get_game_type(game_type).play(state, player_ids, user_id, move)
@@ -0,0 +1,125 @@
+"""Previews for uploaded images: thumbnails, WebP variants and blurhash placeholders.
+
+Everything here runs in worker processes (see ATTACHMENT DERIVATIVES in
+server.py), so the entry point is a plain top-level function taking and
+returning picklable values. Pillow is optional; without it no derivatives are
+produced and uploads are served as they are.
+"""
+
+import math
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
+THUMBNAIL_SIZES = (160, 480)  # longest edge, in pixels
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+BLURHASH_COMPONENTS = (4, 3)
+BLURHASH_SAMPLE = 32  # blurhash is computed on a downscaled copy this wide
+
+def available() -> bool:
+    return Image is not None
+
+def is_image(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+def _save(image, folder: str, name: str, fmt: str, **options) -> dict:
+    path = os.path.join(folder, name)
+    image.save(path, fmt, **options)
+    return {
+        "name": name,
+        "format": fmt.lower(),
+        "width": image.width,
+        "height": image.height,
+        "bytes": os.path.getsize(path),
+    }
+
+def generate(source: str, folder: str, sha256: str) -> dict:
+    """Write every derivative of one image next to it; returns the attachment record fields"""
+    with Image.open(source) as original:
+        original.seek(0)  # first frame of animations
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    derivatives = []
+    for size in THUMBNAIL_SIZES:
+        if max(image.size) <= size:
+            break
+        thumb = image.copy()
+        thumb.thumbnail((size, size), Image.LANCZOS)
+        derivatives.append(_save(thumb, folder, f"{sha256}_{size}.webp", "WEBP", quality=WEBP_QUALITY))
+        if has_alpha:
+            derivatives.append(_save(thumb, folder, f"{sha256}_{size}.png", "PNG", optimize=True))
+        else:
+            derivatives.append(_save(thumb, folder, f"{sha256}_{size}.jpg", "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True))
+    if not source.lower().endswith(".webp"):
+        derivatives.append(_save(image, folder, f"{sha256}_full.webp", "WEBP", quality=WEBP_QUALITY))
+
+    sample = image.convert("RGB")
+    sample.thumbnail((BLURHASH_SAMPLE, BLURHASH_SAMPLE), Image.BILINEAR)
+    return {
+        "width": image.width,
+        "height": image.height,
+        "blurhash": blurhash(list(sample.getdata()), sample.width, sample.height, *BLURHASH_COMPONENTS),
+        "derivatives": derivatives,
+    }
+
+# ----- blurhash (https://blurha.sh), encoder only -----
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+def _encode83(value: int, length: int) -> str:
+    return "".join(_BASE83[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+def _linear_to_srgb(value: float) -> int:
+    v = min(max(value, 0.0), 1.0)
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+def _sign_pow(value: float, exponent: float) -> float:
+    return math.copysign(abs(value) ** exponent, value)
+
+def blurhash(pixels: list, width: int, height: int, x_components: int = 4, y_components: int = 3) -> str:
+    """Encode row-major (r, g, b) pixels as a blurhash string"""
+    linear = [(_srgb_to_linear(r), _srgb_to_linear(g), _srgb_to_linear(b)) for r, g, b in pixels]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            scale = (1 if i == 0 and j == 0 else 2) / (width * height)
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                cy = cos_y[j][y]
+                for x in range(width):
+                    basis = cos_x[i][x] * cy
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, int(max(abs(c) for f in ac for c in f) * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+    else:
+        quantised_max, max_value = 0, 1.0
+    result += _encode83(quantised_max, 1)
+    result += _encode83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for f in ac:
+        r, g, b = (max(0, min(18, int(_sign_pow(c / max_value, 0.5) * 9 + 9.5))) for c in f)
+        result += _encode83(r * 19 * 19 + g * 19 + b, 2)
+    return result
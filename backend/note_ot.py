@@ -0,0 +1,153 @@
+"""Operational transformation over plain text, used for collaborative notes.
+
+An operation is a list of components applied left to right over a document:
+
+    n > 0   retain n characters
+    n < 0   delete -n characters
+    "abc"   insert "abc"
+
+Lengths are counted in Unicode code points. An operation must cover the
+whole document it is applied to: retains plus deletes equal its length.
+"""
+
+from typing import List, Tuple, Union
+
+Component = Union[int, str]
+Operation = List[Component]
+
+
+def validate(op) -> Operation:
+    """Check that an untrusted value (e.g. decoded JSON) is a well-formed operation"""
+    if not isinstance(op, list):
+        raise ValueError("operation must be a list")
+    for component in op:
+        if isinstance(component, bool) or not isinstance(component, (int, str)):
+            raise ValueError(f"invalid component: {component!r}")
+        if component == 0 or component == "":
+            raise ValueError("empty component")
+    return normalize(op)
+
+
+def normalize(op: Operation) -> Operation:
+    """Merge adjacent components of the same kind and drop no-ops"""
+    result: Operation = []
+    for component in op:
+        _push(result, component)
+    return result
+
+
+def _push(op: Operation, component: Component):
+    if component == 0 or component == "":
+        return
+    if op:
+        last = op[-1]
+        if isinstance(component, str) and isinstance(last, str):
+            op[-1] = last + component
+            return
+        if isinstance(component, int) and isinstance(last, int) and (last > 0) == (component > 0):
+            op[-1] = last + component
+            return
+    op.append(component)
+
+
+def base_length(op: Operation) -> int:
+    """Length of the document the operation applies to"""
+    return sum(abs(c) for c in op if isinstance(c, int))
+
+
+def target_length(op: Operation) -> int:
+    """Length of the document the operation produces"""
+    return sum(c if isinstance(c, int) else len(c) for c in op if not isinstance(c, int) or c > 0)
+
+
+def apply(text: str, op: Operation) -> str:
+    if base_length(op) != len(text):
+        raise ValueError(f"operation expects {base_length(op)} characters, document has {len(text)}")
+    parts = []
+    position = 0
+    for component in op:
+        if isinstance(component, str):
+            parts.append(component)
+        elif component > 0:
+            parts.append(text[position:position + component])
+            position += component
+        else:
+            position -= component
+    return "".join(parts)
+
+
+def transform(a: Operation, b: Operation) -> Tuple[Operation, Operation]:
+    """Rebase two concurrent operations on each other.
+
+    Returns (a2, b2) such that apply(apply(t, a), b2) == apply(apply(t, b), a2).
+    When both insert at the same position, a's insert goes first.
+    """
+    if base_length(a) != base_length(b):
+        raise ValueError("concurrent operations must apply to the same document")
+    a2: Operation = []
+    b2: Operation = []
+    ops_a, ops_b = list(a), list(b)
+    i = j = 0
+    ca = ops_a[0] if ops_a else None
+    cb = ops_b[0] if ops_b else None
+    while ca is not None or cb is not None:
+        if isinstance(ca, str):
+            _push(a2, ca)
+            _push(b2, len(ca))
+            i += 1
+            ca = ops_a[i] if i < len(ops_a) else None
+            continue
+        if isinstance(cb, str):
+            _push(a2, len(cb))
+            _push(b2, cb)
+            j += 1
+            cb = ops_b[j] if j < len(ops_b) else None
+            continue
+        if ca is None or cb is None:
+            raise ValueError("operations do not line up")
+
+        if ca > 0 and cb > 0:
+            # retain / retain
+            n = min(ca, cb)
+            _push(a2, n)
+            _push(b2, n)
+            ca, cb = ca - n, cb - n
+        elif ca < 0 and cb < 0:
+            # both deleted the same text
+            n = min(-ca, -cb)
+            ca, cb = ca + n, cb + n
+        elif ca < 0:
+            # a deletes what b retains
+            n = min(-ca, cb)
+            _push(a2, -n)
+            ca, cb = ca + n, cb - n
+        else:
+            # b deletes what a retains
+            n = min(ca, -cb)
+            _push(b2, -n)
+            ca, cb = ca - n, cb + n
+
+        if ca == 0:
+            i += 1
+            ca = ops_a[i] if i < len(ops_a) else None
+        if cb == 0:
+            j += 1
+            cb = ops_b[j] if j < len(ops_b) else None
+    return a2, b2
+
+
+def replace(old: str, new: str) -> Operation:
+    """Smallest single-edit operation turning `old` into `new` (common prefix and suffix kept)"""
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    op: Operation = []
+    _push(op, prefix)
+    _push(op, -(len(old) - prefix - suffix))
+    _push(op, new[prefix:len(new) - suffix])
+    _push(op, suffix)
+    return op
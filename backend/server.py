@@ -1,17 +1,41 @@
-from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Cookie, Response, Request, Header, File, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Cookie, Response, Request, Header, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, TEXT, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
+from abc import ABC, abstractmethod
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Hashable, Iterable
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import uuid
 from datetime import datetime, timezone, timedelta
 import json
+import time
+import heapq
+import asyncio
+import base64
+import hashlib
+import binascii
+import mimetypes
+import stat
+from email.utils import formatdate
 import httpx
+from dateutil.rrule import rrulestr, rruleset, YEARLY, WEEKLY, DAILY, HOURLY, MINUTELY, SECONDLY
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+import note_ot
+import image_derivatives
+import game_engine
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -65,7 +89,8 @@ class Message(BaseModel):
     content: str
     created_at: datetime
     edited: bool = False
-    reactions: Dict[str, List[str]] = {}
+    reactions: Dict[str, List[str]] = {}  # emoji -> user IDs
+    reaction_counts: Dict[str, int] = {}  # emoji -> len(reactions[emoji]), kept in step atomically
     parent_id: Optional[str] = None      # <-- ADD THIS LINE
     starred: bool = False  # <-- ADD THIS LINE
 
@@ -75,7 +100,7 @@ class GameSession(BaseModel):
     id: str
     server_id: str
     channel_id: Optional[str]
-    game_type: str   # e.g., 'tictactoe'
+    game_type: str   # a game_engine.GAME_TYPES name, e.g. 'tictactoe', 'connect4'
     player_ids: List[str]
     state: dict        # e.g. for ttt: {board: [...], turn: ...}
     result: Optional[dict] = None
@@ -84,8 +109,22 @@ class GameSession(BaseModel):
     completed: bool = False
 
 
+class MessageSearchHit(Message):
+    score: float
+
+class ThreadSummary(BaseModel):
+    parent_id: str
+    reply_count: int
+    last_reply_at: datetime
+    root: Optional[Message] = None  # None if the parent was deleted
+
+
 class CreateServerRequest(BaseModel):
     name: str
+    template: str = "default"  # key of SERVER_TEMPLATES
+
+class BulkCreateServersRequest(BaseModel):
+    servers: List[CreateServerRequest]
 
 class CreateChannelRequest(BaseModel):
     name: str
@@ -94,9 +133,20 @@ class CreateChannelRequest(BaseModel):
 class SendMessageRequest(BaseModel):
     content: str
 
+class EditMessageRequest(BaseModel):
+    content: str
+
 class AddReactionRequest(BaseModel):
     emoji: str
 
+class ReactionOperation(BaseModel):
+    message_id: str
+    emoji: str
+    action: str = "add"  # add, remove
+
+class BatchReactionsRequest(BaseModel):
+    operations: List[ReactionOperation]
+
 class VoiceChannelParticipant(BaseModel):
     id: str
     channel_id: str
@@ -116,8 +166,12 @@ class CalendarEvent(BaseModel):
     assigned_to: List[str] = []  # user IDs
     color: str = "#9F86FF"  # Default cosmic purple
     channel_link: Optional[str] = None  # Link to a channel
+    recurrence: Optional[str] = None  # RRULE, e.g. "FREQ=WEEKLY;BYDAY=MO,WE,FR"
+    recurrence_end: Optional[datetime] = None  # end of the last occurrence; None = repeats forever
+    recurrence_id: Optional[datetime] = None  # set on expanded occurrences: their original start
     created_by: str
     created_at: datetime
+    version: int = 0  # bumped on every write; exposed as the ETag
 
 class SubTask(BaseModel):
     id: str
@@ -138,6 +192,7 @@ class Task(BaseModel):
     created_by: str
     created_at: datetime
     updated_at: datetime
+    version: int = 0  # bumped on every write; exposed as the ETag
 
 class Note(BaseModel):
     id: str
@@ -149,6 +204,34 @@ class Note(BaseModel):
     updated_by: str
     created_at: datetime
     updated_at: datetime
+    version: int = 0  # bumped on every write; exposed as the ETag
+    revision: int = 0  # last collaborative op folded into content
+
+class AgendaItem(BaseModel):
+    kind: str  # event, task
+    time: datetime  # event start or task deadline
+    server_id: str
+    event: Optional[CalendarEvent] = None
+    task: Optional[Task] = None
+
+class AttachmentDerivative(BaseModel):
+    name: str
+    url: str
+    format: str  # webp, jpeg, png
+    width: int
+    height: int
+    bytes: int
+
+class Attachment(BaseModel):
+    sha256: str
+    name: str  # the original upload, {sha256}{ext}
+    url: str
+    status: str  # pending, ready, failed
+    width: Optional[int] = None
+    height: Optional[int] = None
+    blurhash: Optional[str] = None  # placeholder to paint while previews load
+    derivatives: List[AttachmentDerivative] = []
+    created_at: datetime
 
 # ===== REQUEST MODELS =====
 class CreateEventRequest(BaseModel):
@@ -159,6 +242,7 @@ class CreateEventRequest(BaseModel):
     assigned_to: List[str] = []
     color: str = "#9F86FF"
     channel_link: Optional[str] = None
+    recurrence: Optional[str] = None
 
 class UpdateEventRequest(BaseModel):
     title: Optional[str] = None
@@ -168,6 +252,7 @@ class UpdateEventRequest(BaseModel):
     assigned_to: Optional[List[str]] = None
     color: Optional[str] = None
     channel_link: Optional[str] = None
+    recurrence: Optional[str] = None  # "" stops the event repeating
 
 class CreateTaskRequest(BaseModel):
     title: str
@@ -186,6 +271,16 @@ class UpdateTaskRequest(BaseModel):
     sub_tasks: Optional[List[SubTask]] = None
     progress: Optional[int] = None
 
+class CreateSubTaskRequest(BaseModel):
+    title: str
+
+class UpdateSubTaskRequest(BaseModel):
+    title: Optional[str] = None
+    completed: Optional[bool] = None  # leave both unset to toggle completed
+
+class MoveSubTaskRequest(BaseModel):
+    index: int
+
 class CreateNoteRequest(BaseModel):
     title: str
     content: str = ""
@@ -196,23 +291,203 @@ class UpdateNoteRequest(BaseModel):
     content: Optional[str] = None
     collaborative: Optional[bool] = None
 
+class CreateGameRequest(BaseModel):
+    game_type: str = "tictactoe"  # any name in game_engine.GAME_TYPES
+    player_ids: List[str]  # in turn order
+
+class CreateUploadSessionRequest(BaseModel):
+    filename: str
+    size: int  # total bytes the client will send
+
+# ===== CACHES =====
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a TTL.
+
+    Entries can carry tags so that everything derived from one source
+    (e.g. all sessions of a user) can be dropped with a single call.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, expires_at, tags)
+        self._tags: Dict[Hashable, set] = {}  # tag -> keys
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value, ttl: Optional[float] = None, tags: Iterable[Hashable] = ()):
+        """Store a value; `ttl` overrides the default lifetime for this entry"""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        if key in self._entries:
+            self._remove(key)
+        tags = tuple(tags)
+        self._entries[key] = (value, time.monotonic() + ttl, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        if key in self._entries:
+            self._remove(key)
+            self.invalidations += 1
+
+    def invalidate_tag(self, tag: Hashable):
+        for key in list(self._tags.get(tag, ())):
+            self.invalidate(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._tags.clear()
+
+    def _remove(self, key: Hashable):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+# session_token -> User, tagged with the user id. Entries never outlive the
+# session itself, and the TTL bounds staleness across workers.
+session_cache = TTLCache(
+    max_size=int(os.environ.get('SESSION_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('SESSION_CACHE_TTL', '60')),
+)
+
+# (server_id, user_id) -> True for confirmed members, tagged with the server
+# id. Only positive answers are kept. Anything that writes servers.members must
+# call membership_cache.invalidate_tag(server_id).
+membership_cache = TTLCache(
+    max_size=int(os.environ.get('MEMBERSHIP_CACHE_SIZE', '50000')),
+    ttl=float(os.environ.get('MEMBERSHIP_CACHE_TTL', '30')),
+)
+
+# channel_id -> {user_id: participant dict with the user embedded}. Join, leave
+# and toggles edit the cached roster in place; the TTL picks up changes made
+# by other workers.
+voice_rosters = TTLCache(
+    max_size=int(os.environ.get('VOICE_ROSTER_CACHE_SIZE', '5000')),
+    ttl=float(os.environ.get('VOICE_ROSTER_TTL', '30')),
+)
+# channel_id -> count of roster writes on this worker. A load that spans a
+# write may have read the old participants, so it is only cached if the
+# count did not move while it ran.
+voice_roster_generations: Dict[str, int] = {}
+
+# (user_id, window, include_completed) -> agenda items, tagged with every
+# server id the agenda drew from. Event and task writes invalidate their
+# server's tag.
+agenda_cache = TTLCache(
+    max_size=int(os.environ.get('AGENDA_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('AGENDA_CACHE_TTL', '60')),
+)
+
+def as_utc(value: datetime) -> datetime:
+    """Mongo hands back naive datetimes; treat them as UTC"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+# ===== PAGINATION =====
+def encode_cursor(timestamp: datetime, doc_id: str) -> str:
+    """Opaque keyset cursor for a (timestamp, id) position"""
+    raw = json.dumps({"t": as_utc(timestamp).isoformat(), "id": doc_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    """Inverse of encode_cursor; rejects anything it did not produce"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["t"]), str(data["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_filter(field: str, cursor: str, older: bool) -> dict:
+    """Match documents strictly before (older=True) or after a cursor position"""
+    timestamp, doc_id = decode_cursor(cursor)
+    op = "$lt" if older else "$gt"
+    return {"$or": [
+        {field: {op: timestamp}},
+        {field: timestamp, "id": {op: doc_id}},
+    ]}
+
+# ===== HTTP CACHING =====
+def json_etag(content) -> str:
+    """Strong ETag over the canonical JSON form of a response body"""
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return '"' + hashlib.sha1(canonical.encode()).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 asks for GET)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
 # ===== AUTH HELPERS =====
+def extract_token(authorization: Optional[str] = None, session_token: Optional[str] = None) -> Optional[str]:
+    """Pick the session token from the cookie or the Authorization header"""
+    if session_token:
+        return session_token
+    if authorization and authorization.startswith("Bearer "):
+        return authorization.replace("Bearer ", "")
+    return None
+
 async def get_current_user(authorization: Optional[str] = None, session_token: Optional[str] = None) -> Optional[User]:
     """Get current user from either Authorization header or session_token cookie"""
-    token = None
-    
-    if session_token:
-        token = session_token
-    elif authorization and authorization.startswith("Bearer "):
-        token = authorization.replace("Bearer ", "")
-    
+    token = extract_token(authorization, session_token)
     if not token:
         return None
     
+    cached = session_cache.get(token)
+    if cached is not None:
+        return cached
+    
     # Check if session exists and not expired
+    now = datetime.now(timezone.utc)
     session = await db.user_sessions.find_one({
         "session_token": token,
-        "expires_at": {"$gt": datetime.now(timezone.utc)}
+        "expires_at": {"$gt": now}
     })
     
     if not session:
@@ -223,7 +498,24 @@ async def get_current_user(authorization: Optional[str] = None, session_token: O
     if not user_doc:
         return None
     
-    return User(**user_doc)
+    user = User(**user_doc)
+    session_ttl = (as_utc(session["expires_at"]) - now).total_seconds()
+    session_cache.set(token, user, ttl=min(session_cache.ttl, session_ttl), tags=[user.id])
+    return user
+
+async def is_server_member(server_id: str, user_id: str) -> bool:
+    """Indexed existence check; never transfers the members array"""
+    key = (server_id, user_id)
+    if membership_cache.get(key):
+        return True
+    found = await db.servers.find_one({"id": server_id, "members": user_id}, {"_id": 0, "id": 1})
+    if found:
+        membership_cache.set(key, True, tags=[server_id])
+    return found is not None
+
+async def require_server_member(server_id: str, user: User):
+    if not await is_server_member(server_id, user.id):
+        raise HTTPException(status_code=403, detail="Not authorized")
 
 # ===== AUTH ROUTES =====
 @api_router.get("/auth/session")
@@ -261,6 +553,7 @@ async def process_session(session_id: str, response: Response):
                 {"id": user_id},
                 {"$set": {"status": "online"}}
             )
+            session_cache.invalidate_tag(user_id)
         
         # Create session
         session_token = user_data["session_token"]
@@ -298,59 +591,167 @@ async def get_me(authorization: Optional[str] = Header(None), session_token: Opt
     return user
 
 @api_router.post("/auth/logout")
-async def logout(response: Response, session_token: Optional[str] = Cookie(None)):
+async def logout(response: Response, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
     """Logout user"""
-    if session_token:
-        # Delete session from database
-        await db.user_sessions.delete_one({"session_token": session_token})
-        
-        # Get user_id before deleting
-        session = await db.user_sessions.find_one({"session_token": session_token})
+    token = extract_token(authorization, session_token)
+    if token:
+        # Delete session from database, keeping the user_id it pointed at
+        session = await db.user_sessions.find_one_and_delete({"session_token": token})
+        session_cache.invalidate(token)
         if session:
             await db.users.update_one(
                 {"id": session["user_id"]},
                 {"$set": {"status": "offline"}}
             )
+            session_cache.invalidate_tag(session["user_id"])
     
     # Clear cookie
     response.delete_cookie(key="session_token", path="/")
     return {"success": True}
 
-# ===== SERVER ROUTES =====
-@api_router.post("/servers", response_model=Server)
-async def create_server(request: CreateServerRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
-    """Create a new server"""
-    user = await get_current_user(authorization, session_token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    server_id = str(uuid.uuid4())
+# ===== SERVER PROVISIONING =====
+# What a new server starts with. Notes and tasks are optional starter content.
+SERVER_TEMPLATES = {
+    "default": {
+        "channels": [
+            {"name": "general", "type": "text"},
+            {"name": "voice-lounge", "type": "voice"},
+        ],
+    },
+    "study": {
+        "channels": [
+            {"name": "general", "type": "text"},
+            {"name": "resources", "type": "text"},
+            {"name": "study-room", "type": "video"},
+        ],
+        "notes": [
+            {"title": "Welcome", "content": "# Welcome\n\nPin shared notes and resources here."},
+        ],
+        "tasks": [
+            {"title": "Set up the study schedule", "priority": "high"},
+        ],
+    },
+    "gaming": {
+        "channels": [
+            {"name": "general", "type": "text"},
+            {"name": "lfg", "type": "text"},
+            {"name": "voice-lounge", "type": "voice"},
+            {"name": "streams", "type": "video"},
+        ],
+    },
+}
+
+PROVISION_CHUNK_SIZE = 200  # servers per transaction
+
+_transactions_supported: Optional[bool] = None
+
+async def supports_transactions() -> bool:
+    """Multi-document transactions need a replica set or mongos"""
+    global _transactions_supported
+    if _transactions_supported is None:
+        hello = await client.admin.command("hello")
+        _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return _transactions_supported
+
+def build_server_bundle(request: CreateServerRequest, user: User) -> tuple:
+    """Build the server and all its templated documents without touching the DB"""
+    template = SERVER_TEMPLATES.get(request.template)
+    if template is None:
+        raise HTTPException(status_code=400, detail=f"Unknown template: {request.template}")
+    
+    now = datetime.now(timezone.utc)
     server = Server(
-        id=server_id,
+        id=str(uuid.uuid4()),
         name=request.name,
         created_by=user.id,
         members=[user.id],
-        created_at=datetime.now(timezone.utc)
+        created_at=now
     )
-    await db.servers.insert_one(server.dict())
-    
-    # Create default channels
-    default_channels = [
-        {"name": "general", "type": "text"},
-        {"name": "voice-lounge", "type": "voice"},
-    ]
+    docs = {
+        "channels": [
+            Channel(id=str(uuid.uuid4()), server_id=server.id, name=ch["name"], type=ch["type"], created_at=now).dict()
+            for ch in template["channels"]
+        ],
+        "notes": [
+            Note(id=str(uuid.uuid4()), server_id=server.id, title=n["title"], content=n.get("content", ""),
+                 created_by=user.id, updated_by=user.id, created_at=now, updated_at=now).dict()
+            for n in template.get("notes", [])
+        ],
+        "tasks": [
+            Task(id=str(uuid.uuid4()), server_id=server.id, title=t["title"], priority=t.get("priority", "medium"),
+                 created_by=user.id, created_at=now, updated_at=now).dict()
+            for t in template.get("tasks", [])
+        ],
+    }
+    return server, docs
+
+async def provision_servers(bundles: List[tuple]) -> List[Server]:
+    """Insert a group of server bundles as one unit, one insert_many per collection.
+
+    On a replica set this is a real transaction. A standalone mongod has no
+    transactions, so a failure part-way is compensated by deleting whatever
+    the group already wrote.
+    """
+    servers = [server for server, _ in bundles]
+    writes = {"servers": [server.dict() for server in servers], "channels": [], "notes": [], "tasks": []}
+    for _, docs in bundles:
+        for collection, items in docs.items():
+            writes[collection].extend(items)
+    
+    if await supports_transactions():
+        async with await client.start_session() as session:
+            async with session.start_transaction():
+                for collection, items in writes.items():
+                    if items:
+                        await db[collection].insert_many(items, session=session)
+        return servers
     
-    for ch in default_channels:
-        channel = Channel(
-            id=str(uuid.uuid4()),
-            server_id=server_id,
-            name=ch["name"],
-            type=ch["type"],
-            created_at=datetime.now(timezone.utc)
-        )
-        await db.channels.insert_one(channel.dict())
+    try:
+        for collection, items in writes.items():
+            if items:
+                await db[collection].insert_many(items, ordered=False)
+    except Exception:
+        server_ids = [server.id for server in servers]
+        await db.servers.delete_many({"id": {"$in": server_ids}})
+        for collection in ("channels", "notes", "tasks"):
+            await db[collection].delete_many({"server_id": {"$in": server_ids}})
+        raise
+    return servers
+
+# ===== SERVER ROUTES =====
+@api_router.post("/servers", response_model=Server)
+async def create_server(request: CreateServerRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Create a new server from a template"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
     
-    return server
+    servers = await provision_servers([build_server_bundle(request, user)])
+    return servers[0]
+
+@api_router.post("/servers/bulk")
+async def bulk_create_servers(request: BulkCreateServersRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Provision many servers at once, PROVISION_CHUNK_SIZE servers per unit.
+
+    A failing chunk does not undo the chunks before it; its indices are
+    reported under `failed` so the caller can retry just those.
+    """
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if len(request.servers) > 5000:
+        raise HTTPException(status_code=400, detail="At most 5000 servers per request")
+    
+    bundles = [build_server_bundle(r, user) for r in request.servers]
+    created, failed = [], []
+    for start in range(0, len(bundles), PROVISION_CHUNK_SIZE):
+        chunk = bundles[start:start + PROVISION_CHUNK_SIZE]
+        try:
+            created.extend(await provision_servers(chunk))
+        except Exception as e:
+            logger.error(f"Bulk provisioning chunk at {start} failed: {e}")
+            failed.extend(range(start, start + len(chunk)))
+    return {"servers": created, "failed": failed}
 
 @api_router.get("/servers", response_model=List[Server])
 async def get_servers(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
@@ -378,6 +779,56 @@ async def get_server(server_id: str, authorization: Optional[str] = Header(None)
     
     return Server(**server)
 
+@api_router.get("/servers/{server_id}/snapshot")
+async def get_server_snapshot(
+    server_id: str,
+    if_none_match: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
+    """Everything needed to open a server: details, channels, members and voice participants"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    server = await db.servers.find_one({"id": server_id}, {"_id": 0})
+    if not server:
+        raise HTTPException(status_code=404, detail="Server not found")
+    if user.id not in server["members"]:
+        raise HTTPException(status_code=403, detail="Not a member of this server")
+    
+    # Channels come back with their participants joined in, so the two
+    # remaining reads are independent and can run side by side.
+    channels, members = await asyncio.gather(
+        db.channels.aggregate([
+            {"$match": {"server_id": server_id}},
+            {"$lookup": {"from": "voice_participants", "localField": "id", "foreignField": "channel_id", "as": "participants"}},
+            {"$project": {"_id": 0, "participants._id": 0}},
+        ]).to_list(None),
+        db.users.find({"id": {"$in": server["members"]}}, {"_id": 0}).to_list(None),
+    )
+    
+    users_by_id = {m["id"]: User(**m).dict() for m in members}
+    participants = {}
+    for channel in channels:
+        joined = channel.pop("participants")
+        if channel["type"] in ("voice", "video"):
+            participants[channel["id"]] = [
+                {**p, "user": users_by_id[p["user_id"]]} for p in joined if p["user_id"] in users_by_id
+            ]
+    
+    snapshot = jsonable_encoder({
+        "server": Server(**server),
+        "channels": [Channel(**c) for c in channels],
+        "members": list(users_by_id.values()),
+        "participants": participants,
+    })
+    etag = json_etag(snapshot)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(snapshot, headers=headers)
+
 # ===== CHANNEL ROUTES =====
 @api_router.post("/servers/{server_id}/channels", response_model=Channel)
 async def create_channel(server_id: str, request: CreateChannelRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
@@ -386,10 +837,7 @@ async def create_channel(server_id: str, request: CreateChannelRequest, authoriz
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    # Check if user is member of server
-    server = await db.servers.find_one({"id": server_id})
-    if not server or user.id not in server["members"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    await require_server_member(server_id, user)
     
     channel = Channel(
         id=str(uuid.uuid4()),
@@ -408,33 +856,242 @@ async def get_channels(server_id: str, authorization: Optional[str] = Header(Non
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    # Check if user is member
-    server = await db.servers.find_one({"id": server_id})
-    if not server or user.id not in server["members"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    await require_server_member(server_id, user)
     
     channels = await db.channels.find({"server_id": server_id}).to_list(1000)
     return [Channel(**c) for c in channels]
 
 # ===== MESSAGE ROUTES =====
 @api_router.get("/channels/{channel_id}/messages", response_model=List[Message])
-async def get_messages(channel_id: str, limit: int = 50, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
-    """Get messages from a channel"""
+async def get_messages(
+    channel_id: str,
+    response: Response,
+    limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
+    """Get a page of messages from a channel in chronological order.
+
+    Without a cursor this is the newest page. `before` walks back through
+    history and `after` walks forward; X-Next-Cursor continues in the same
+    direction and X-Prev-Cursor turns around.
+    """
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    messages = await db.messages.find({"channel_id": channel_id}).sort("created_at", -1).limit(limit).to_list(limit)
-    messages.reverse()  # Return in chronological order
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    
+    limit = max(1, min(limit, 200))
+    older = after is None
+    query = {"channel_id": channel_id}
+    if before or after:
+        query.update(keyset_filter("created_at", before or after, older))
+    direction = DESCENDING if older else ASCENDING
+    
+    # One extra row tells us whether another page exists
+    messages = await db.messages.find(query, {"_id": 0}).sort(
+        [("created_at", direction), ("id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if older:
+        messages.reverse()  # Return in chronological order
+    
+    if messages:
+        first, last = messages[0], messages[-1]
+        edge, back = (first, last) if older else (last, first)
+        if has_more:
+            response.headers["X-Next-Cursor"] = encode_cursor(edge["created_at"], edge["id"])
+        if before or after:
+            response.headers["X-Prev-Cursor"] = encode_cursor(back["created_at"], back["id"])
     return [Message(**m) for m in messages]
 
-# backend/server.py
+@api_router.get("/channels/{channel_id}/threads", response_model=List[ThreadSummary])
+async def get_threads(channel_id: str, limit: int = 50, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Get the channel's threads, most recently active first, with reply counts"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    limit = max(1, min(limit, 200))
+    pipeline = [
+        {"$match": {"channel_id": channel_id, "parent_id": {"$ne": None}}},
+        {"$group": {
+            "_id": "$parent_id",
+            "reply_count": {"$sum": 1},
+            "last_reply_at": {"$max": "$created_at"},
+        }},
+        {"$sort": {"last_reply_at": -1}},
+        {"$limit": limit},
+        {"$lookup": {"from": "messages", "localField": "_id", "foreignField": "id", "as": "root"}},
+        {"$project": {
+            "_id": 0,
+            "parent_id": "$_id",
+            "reply_count": 1,
+            "last_reply_at": 1,
+            "root": {"$arrayElemAt": ["$root", 0]},
+        }},
+        {"$project": {"root._id": 0}},
+    ]
+    threads = await db.messages.aggregate(pipeline).to_list(limit)
+    return [ThreadSummary(**t) for t in threads]
 
-@api_router.get("/channels/{channel_id}/threads")
-async def get_threads(channel_id: str):
-    messages = await db.messages.find({"channel_id": channel_id}).to_list(1000)
-    return messages  # Optionally, post-process to build a tree for UI
+@api_router.get("/channels/{channel_id}/threads/{parent_id}/replies", response_model=List[Message])
+async def get_thread_replies(
+    channel_id: str,
+    parent_id: str,
+    request: Request,
+    response: Response,
+    limit: Optional[int] = None,
+    after: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
+    """Get the replies to a message, oldest first.
 
+    JSON responses are paged (X-Next-Cursor feeds `after`). Clients that
+    send Accept: application/x-ndjson get the rest of the thread streamed
+    one message per line instead.
+    """
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    query = {"channel_id": channel_id, "parent_id": parent_id}
+    if after:
+        query.update(keyset_filter("created_at", after, older=False))
+    cursor = db.messages.find(query, {"_id": 0}).sort([("created_at", ASCENDING), ("id", ASCENDING)])
+    
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        if limit:
+            cursor = cursor.limit(max(1, limit))
+        
+        async def stream():
+            async for doc in cursor.batch_size(200):
+                yield json.dumps(jsonable_encoder(Message(**doc))) + "\n"
+        
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+    
+    limit = max(1, min(limit or 50, 200))
+    replies = await cursor.limit(limit + 1).to_list(limit + 1)
+    if len(replies) > limit:
+        replies = replies[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(replies[-1]["created_at"], replies[-1]["id"])
+    return [Message(**r) for r in replies]
+
+
+# ===== MESSAGE WRITE-BEHIND =====
+class MessageWriteBehind:
+    """Coalesces message inserts into unordered insert_many batches.
+
+    A batch is flushed when it reaches `batch_size` or when `flush_interval`
+    seconds have passed. The queue is bounded, so once it is full, callers
+    wait for room (backpressure) instead of buffering without limit.
+    """
+
+    def __init__(self, collection, batch_size: int, flush_interval: float, max_queue: int):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.enqueued = 0
+        self.flushed = 0
+        self.failed = 0
+        self.batches = 0
+        self.backpressure_waits = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush whatever is still queued, then stop"""
+        self._stopping = True
+        if self._task:
+            await self._task
+
+    async def enqueue(self, doc: dict):
+        if self.queue.full():
+            self.backpressure_waits += 1
+        await self.queue.put(doc)
+        self.enqueued += 1
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not (self._stopping and self.queue.empty()):
+            batch = []
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch: List[dict]):
+        started = time.perf_counter()
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+            self.flushed += len(batch)
+        except BulkWriteError as e:
+            failed = len(e.details.get("writeErrors", []))
+            self.failed += failed
+            self.flushed += len(batch) - failed
+            logger.error(f"Write-behind batch: {failed} of {len(batch)} messages failed")
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Write-behind batch of {len(batch)} messages failed: {e}")
+        elapsed = (time.perf_counter() - started) * 1000
+        self.batches += 1
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = round(elapsed, 2)
+        self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+
+    def stats(self) -> dict:
+        return {
+            "mode": "write_behind",
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "avg_batch_size": round(self.flushed / self.batches, 2) if self.batches else 0.0,
+            "backpressure_waits": self.backpressure_waits,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+        }
+
+# MESSAGE_WRITE_MODE=sync (default) keeps every insert on the request path.
+# write_behind acknowledges once the message is queued: lower latency under
+# bursts, but messages still queued when a worker crashes are lost.
+message_writer: Optional[MessageWriteBehind] = None
+if os.environ.get('MESSAGE_WRITE_MODE', 'sync') == 'write_behind':
+    message_writer = MessageWriteBehind(
+        db.messages,
+        batch_size=int(os.environ.get('MESSAGE_WRITE_BATCH_SIZE', '500')),
+        flush_interval=float(os.environ.get('MESSAGE_WRITE_FLUSH_MS', '50')) / 1000,
+        max_queue=int(os.environ.get('MESSAGE_WRITE_QUEUE_SIZE', '20000')),
+    )
+
+# Event types only the server may publish on /ws/{channel_id}
+SERVER_EVENT_TYPES = {"new_message", "thread_reply", "message_edited", "reaction_added", "reaction_removed", "reactions_updated"}
+
+async def publish_channel_event(channel_id: str, event_type: str, **payload):
+    """Push a typed event to everyone subscribed to the channel, on any worker"""
+    await manager.broadcast_event({"type": event_type, "channel_id": channel_id, **payload}, channel_id)
 
 # backend/server.py
 # Find: @api_router.post("/channels/{channel_id}/messages", ...)
@@ -459,34 +1116,203 @@ async def send_message(
         parent_id=parent_id,       # <-- PASS THROUGH
         starred=is_starred         # <-- PASS THROUGH
     )
-    await db.messages.insert_one(message.dict())
+    if message_writer:
+        await message_writer.enqueue(message.dict())
+    else:
+        await db.messages.insert_one(message.dict())
+    await publish_channel_event(channel_id, "thread_reply" if parent_id else "new_message", message=message)
     return message
 
-
-@api_router.post("/messages/{message_id}/reactions")
-async def add_reaction(message_id: str, request: AddReactionRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
-    """Add reaction to a message"""
+@api_router.put("/messages/{message_id}", response_model=Message)
+async def edit_message(message_id: str, request: EditMessageRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Edit one of your own messages"""
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    message = await db.messages.find_one({"id": message_id})
+    message = await db.messages.find_one_and_update(
+        {"id": message_id, "user_id": user.id},
+        {"$set": {"content": request.content, "edited": True}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
     if not message:
+        if await db.messages.find_one({"id": message_id}, {"_id": 1}):
+            raise HTTPException(status_code=403, detail="Not authorized")
         raise HTTPException(status_code=404, detail="Message not found")
     
-    reactions = message.get("reactions", {})
-    if request.emoji not in reactions:
-        reactions[request.emoji] = []
-    
-    if user.id not in reactions[request.emoji]:
-        reactions[request.emoji].append(user.id)
-    
-    await db.messages.update_one(
-        {"id": message_id},
-        {"$set": {"reactions": reactions}}
+    message = Message(**message)
+    await publish_channel_event(message.channel_id, "message_edited", message=message)
+    return message
+
+
+def reaction_update(message_id: str, emoji: str, user_id: str, add: bool) -> tuple:
+    """Filter and pipeline update for one atomic reaction toggle.
+
+    The filter only matches when the update would change something. The
+    counter is set to the size of the new user list rather than incremented,
+    so messages reacted to before reaction_counts existed get a correct count
+    on their first change instead of starting from zero.
+    """
+    if not emoji or len(emoji) > 64 or "." in emoji or emoji.startswith("$"):
+        raise HTTPException(status_code=400, detail="Invalid emoji")
+    users_field = f"reactions.{emoji}"
+    count_field = f"reaction_counts.{emoji}"
+    current = {"$ifNull": [f"${users_field}", []]}
+    if add:
+        query = {"id": message_id, users_field: {"$ne": user_id}}
+        users = {"$concatArrays": [current, [{"$literal": user_id}]]}
+    else:
+        query = {"id": message_id, users_field: user_id}
+        users = {"$filter": {"input": current, "cond": {"$ne": ["$$this", {"$literal": user_id}]}}}
+    return query, [
+        {"$set": {users_field: users}},
+        {"$set": {count_field: {"$size": f"${users_field}"}}},
+    ]
+
+async def apply_reaction(message_id: str, emoji: str, user_id: str, add: bool) -> bool:
+    """Add or remove a reaction in one round-trip and tell the channel; returns whether it changed"""
+    query, update = reaction_update(message_id, emoji, user_id, add)
+    message = await db.messages.find_one_and_update(
+        query,
+        update,
+        projection={"_id": 0, "channel_id": 1, f"reaction_counts.{emoji}": 1},
+        return_document=ReturnDocument.AFTER
     )
+    if message:
+        await publish_channel_event(
+            message["channel_id"],
+            "reaction_added" if add else "reaction_removed",
+            message_id=message_id,
+            emoji=emoji,
+            user_id=user_id,
+            count=message.get("reaction_counts", {}).get(emoji, 0),
+        )
+        return True
+    # Either a no-op (already reacted / not reacted) or no such message
+    if not await db.messages.find_one({"id": message_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Message not found")
+    return False
+
+@api_router.post("/messages/{message_id}/reactions")
+async def add_reaction(message_id: str, request: AddReactionRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Add reaction to a message"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
     
-    return {"success": True}
+    changed = await apply_reaction(message_id, request.emoji, user.id, add=True)
+    return {"success": True, "changed": changed}
+
+@api_router.delete("/messages/{message_id}/reactions/{emoji}")
+async def remove_reaction(message_id: str, emoji: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Remove the current user's reaction from a message"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    changed = await apply_reaction(message_id, emoji, user.id, add=False)
+    return {"success": True, "changed": changed}
+
+@api_router.post("/reactions/batch")
+async def batch_reactions(request: BatchReactionsRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Apply many reaction adds/removes for the current user in one bulk write"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if len(request.operations) > 500:
+        raise HTTPException(status_code=400, detail="At most 500 operations per batch")
+    
+    ops = []
+    for op in request.operations:
+        if op.action not in ("add", "remove"):
+            raise HTTPException(status_code=400, detail=f"Unknown action: {op.action}")
+        query, update = reaction_update(op.message_id, op.emoji, user.id, op.action == "add")
+        ops.append(UpdateOne(query, update))
+    
+    if not ops:
+        return {"success": True, "applied": 0}
+    result = await db.messages.bulk_write(ops, ordered=False)
+    
+    if result.modified_count:
+        # One read for the new counters of every touched message, then one event each
+        message_ids = list({op.message_id for op in request.operations})
+        touched = await db.messages.find(
+            {"id": {"$in": message_ids}},
+            {"_id": 0, "id": 1, "channel_id": 1, "reactions": 1, "reaction_counts": 1}
+        ).to_list(None)
+        for m in touched:
+            await publish_channel_event(
+                m["channel_id"],
+                "reactions_updated",
+                message_id=m["id"],
+                reactions=m.get("reactions", {}),
+                reaction_counts=m.get("reaction_counts", {}),
+            )
+    return {"success": True, "applied": result.modified_count}
+
+# ===== SEARCH =====
+# Deep skips walk every skipped text-index hit; past this, narrow the query
+MAX_SEARCH_OFFSET = 1000
+
+@api_router.get("/search/messages")
+async def search_messages(
+    q: str,
+    server_id: Optional[str] = None,
+    channel_id: Optional[str] = None,
+    author_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 25,
+    offset: int = 0,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
+    """Full-text message search within a channel or a whole server, best matches first.
+
+    Backed by the messages text index, which Mongo keeps up to date on
+    every insert and edit.
+    """
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Empty query")
+    if not 0 <= offset <= MAX_SEARCH_OFFSET:
+        raise HTTPException(status_code=400, detail=f"offset must be between 0 and {MAX_SEARCH_OFFSET}")
+    
+    if channel_id:
+        channel = await db.channels.find_one({"id": channel_id}, {"_id": 0, "server_id": 1})
+        if not channel:
+            raise HTTPException(status_code=404, detail="Channel not found")
+        await require_server_member(channel["server_id"], user)
+        query = {"channel_id": channel_id}
+    elif server_id:
+        await require_server_member(server_id, user)
+        channels = await db.channels.find({"server_id": server_id}, {"_id": 0, "id": 1}).to_list(None)
+        query = {"channel_id": {"$in": [c["id"] for c in channels]}}
+    else:
+        raise HTTPException(status_code=400, detail="Pass server_id or channel_id")
+    
+    query["$text"] = {"$search": q}
+    if author_id:
+        query["user_id"] = author_id
+    if since or until:
+        query["created_at"] = {}
+        if since:
+            query["created_at"]["$gte"] = since
+        if until:
+            query["created_at"]["$lte"] = until
+    
+    limit = max(1, min(limit, 100))
+    hits = await db.messages.find(
+        query, {"_id": 0, "score": {"$meta": "textScore"}}
+    ).sort([("score", {"$meta": "textScore"}), ("created_at", DESCENDING)]).skip(offset).limit(limit + 1).to_list(limit + 1)
+    
+    return {
+        "results": [MessageSearchHit(**h) for h in hits[:limit]],
+        "next_offset": offset + limit if len(hits) > limit and offset + limit <= MAX_SEARCH_OFFSET else None,
+    }
 
 # ===== PRESENCE ROUTES =====
 @api_router.post("/presence/status")
@@ -500,6 +1326,7 @@ async def update_status(status: str, authorization: Optional[str] = Header(None)
         {"id": user.id},
         {"$set": {"status": status}}
     )
+    session_cache.invalidate_tag(user.id)
     return {"success": True}
 
 @api_router.get("/servers/{server_id}/members")
@@ -509,14 +1336,224 @@ async def get_server_members(server_id: str, authorization: Optional[str] = Head
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    server = await db.servers.find_one({"id": server_id})
-    if not server or user.id not in server["members"]:
+    server = await db.servers.find_one({"id": server_id, "members": user.id}, {"_id": 0, "members": 1})
+    if not server:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     members = await db.users.find({"id": {"$in": server["members"]}}).to_list(1000)
     return [User(**m) for m in members]
 
+# ===== CALENDAR RECURRENCE =====
+# Recurring events are stored once, as their first occurrence plus an RRULE,
+# and expanded per requested window. recurrence_end lets the window query
+# skip series that finished before the window starts.
+#
+# dateutil only checks UNTIL when a rule yields, so a rule whose BY* parts
+# rule out every day walks the calendar to year 9999. Rules are therefore
+# checked for an occurrence when written, and every walk runs on a copy
+# moved by whole 400-year cycles (the calendar repeats exactly) so that the
+# end of dateutil's calendar lies at most one cycle past where we stop.
+RECURRENCE_HORIZON = timedelta(days=int(os.environ.get('RECURRENCE_HORIZON_DAYS', '3660')))
+# A series whose end is more than this many occurrences away is treated as open-ended
+MAX_EXPANDED_OCCURRENCES = int(os.environ.get('MAX_EXPANDED_OCCURRENCES', '5000'))
+# Per series, per request; a window query stops expanding a series after this many
+MAX_OCCURRENCES_PER_SERIES = int(os.environ.get('MAX_OCCURRENCES_PER_SERIES', '1000'))
+MAX_CALENDAR_WINDOW = timedelta(days=int(os.environ.get('MAX_CALENDAR_WINDOW_DAYS', '400')))
+GREGORIAN_CYCLE = timedelta(days=146097)  # 400 years, a whole number of weeks
+# Rules with a fixed step can start at any step boundary without changing their later occurrences
+RRULE_STEPS = {WEEKLY: timedelta(weeks=1), DAILY: timedelta(days=1), HOURLY: timedelta(hours=1), MINUTELY: timedelta(minutes=1)}
+# Every kind of year (leap or not, each starting weekday) occurs between these
+PROBE_YEARS = (datetime(9901, 1, 1, tzinfo=timezone.utc), datetime(9999, 12, 31, tzinfo=timezone.utc))
+
+def rebuild_rules(rules: rruleset, rule_start=lambda r: r._dtstart, shift: timedelta = timedelta(0)) -> rruleset:
+    """A copy of a rule set with each rule restarted at rule_start(rule) and every date moved by `shift`"""
+    def moved(r):
+        return r.replace(dtstart=rule_start(r) + shift, until=r._until and r._until + shift)
+    result = rruleset()
+    for r in rules._rrule:
+        result.rrule(moved(r))
+    for r in rules._exrule:
+        result.exrule(moved(r))
+    for d in rules._rdate:
+        result.rdate(d + shift)
+    for d in rules._exdate:
+        result.exdate(d + shift)
+    return result
+
+def calendar_shift(until: datetime) -> timedelta:
+    """Whole 400-year cycles that move `until` as close to the end of the calendar as they can"""
+    return GREGORIAN_CYCLE * ((PROBE_YEARS[1] - until) // GREGORIAN_CYCLE)
+
+def parse_recurrence(rule: str, start_time: datetime) -> rruleset:
+    try:
+        rules = rrulestr(rule, dtstart=as_utc(start_time), forceset=True)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid recurrence rule: {e}")
+    for r in rules._rrule + rules._exrule:
+        if r._interval < 1:
+            raise HTTPException(status_code=400, detail="Recurrence interval must be at least 1")
+        if r._freq == SECONDLY:
+            raise HTTPException(status_code=400, detail="Recurrence must not repeat more often than every minute")
+        if r._count is not None and r._count > MAX_EXPANDED_OCCURRENCES:
+            raise HTTPException(status_code=400, detail=f"Recurrence COUNT must not exceed {MAX_EXPANDED_OCCURRENCES}")
+    return rules
+
+def check_recurrence_days(rules: rruleset):
+    """Reject rules whose BY* parts match no day of any year, without walking to year 9999"""
+    for r in rules._rrule:
+        probe = r.replace(freq=YEARLY, interval=1, count=1, until=None, bysetpos=None, dtstart=PROBE_YEARS[0])
+        if not list(probe):
+            raise HTTPException(status_code=400, detail="Recurrence rule matches no dates")
+
+def recurrence_end(rule: Optional[str], start_time: datetime, end_time: datetime) -> Optional[datetime]:
+    """End of the series' last occurrence, or None if it runs past the horizon.
+
+    Rejects rules with no occurrence within RECURRENCE_HORIZON of the start.
+    """
+    if not rule:
+        return None
+    start = as_utc(start_time)
+    rules = parse_recurrence(rule, start)
+    check_recurrence_days(rules)
+    horizon = start + RECURRENCE_HORIZON
+    shift = calendar_shift(horizon)
+    # Without COUNT or UNTIL only the first occurrence needs finding
+    open_ended = any(r._count is None and r._until is None for r in rules._rrule)
+    last = None
+    try:
+        for n, occurrence in enumerate(rebuild_rules(rules, shift=shift)):
+            occurrence -= shift
+            if occurrence > horizon or n >= MAX_EXPANDED_OCCURRENCES:
+                open_ended = True
+                break
+            last = occurrence
+            if open_ended:
+                break
+    except ValueError as e:
+        # e.g. an interval that never lands on one of the BYHOUR values
+        raise HTTPException(status_code=400, detail=f"Invalid recurrence rule: {e}")
+    if last is None:
+        raise HTTPException(status_code=400, detail=f"Recurrence has no occurrence within {RECURRENCE_HORIZON.days} days")
+    if open_ended:
+        return None
+    return last + (as_utc(end_time) - start)
+
+def fast_forward(r, after: datetime) -> datetime:
+    """The latest start for `r` at or before `after` that leaves its later occurrences unchanged"""
+    step = RRULE_STEPS.get(r._freq)
+    if step is None or r._count is not None or r._dtstart >= after:
+        return r._dtstart
+    step *= r._interval
+    return r._dtstart + step * ((after - r._dtstart) // step)
+
+def expand_occurrences(event: dict, window_start: datetime, window_end: datetime) -> Iterable[CalendarEvent]:
+    """The occurrences of a recurring event that overlap [window_start, window_end), lazily.
+
+    The walk starts near the window rather than at the first occurrence, ends
+    within a calendar cycle of window_end even for rules that stop matching,
+    and produces at most MAX_OCCURRENCES_PER_SERIES occurrences.
+    """
+    start, end = as_utc(event["start_time"]), as_utc(event["end_time"])
+    duration = end - start
+    after = window_start - duration
+    shift = calendar_shift(window_end)
+    try:
+        rules = parse_recurrence(event["recurrence"], start)
+        check_recurrence_days(rules)
+    except HTTPException as e:
+        # Saved before these checks existed; one bad series must not break the whole window
+        logger.warning(f"Skipping recurrence of event {event.get('id')}: {e.detail}")
+        return
+    rules = rebuild_rules(rules, lambda r: fast_forward(r, after), shift)
+    for occurrence in rules.xafter(after + shift, count=MAX_OCCURRENCES_PER_SERIES, inc=False):
+        occurrence -= shift
+        if occurrence >= window_end:
+            break
+        yield CalendarEvent(**{
+            **event,
+            "start_time": occurrence,
+            "end_time": occurrence + duration,
+            "recurrence_id": occurrence,
+        })
+
+def overlap_query(server_id: str, window_start: datetime, window_end: datetime) -> dict:
+    """Events, single or recurring, that may overlap [window_start, window_end)"""
+    return {
+        "server_id": server_id,
+        "start_time": {"$lt": window_end},
+        "$or": [
+            {"recurrence": None, "end_time": {"$gt": window_start}},
+            {"recurrence": {"$ne": None}, "recurrence_end": None},
+            {"recurrence": {"$ne": None}, "recurrence_end": {"$gt": window_start}},
+        ],
+    }
+
+def parse_window(start_date: str, end_date: str) -> tuple:
+    try:
+        window_start, window_end = as_utc(datetime.fromisoformat(start_date)), as_utc(datetime.fromisoformat(end_date))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be ISO 8601")
+    if window_end <= window_start:
+        raise HTTPException(status_code=400, detail="end_date must be after start_date")
+    if window_end - window_start > MAX_CALENDAR_WINDOW:
+        raise HTTPException(status_code=400, detail=f"Window must not exceed {MAX_CALENDAR_WINDOW.days} days")
+    return window_start, window_end
+
+# ===== VERSIONED WRITES =====
+# Events, tasks and notes carry a version that every write increments. It is
+# sent as the ETag; a client that echoes it in If-Match only succeeds if
+# nobody wrote in between (412 otherwise).
+def version_etag(version: int) -> str:
+    return f'"v{version}"'
+
+def if_match_version(if_match: Optional[str]) -> Optional[int]:
+    """The version an If-Match header requires, or None for an unconditional write"""
+    if not if_match or if_match.strip() == "*":
+        return None
+    tag = if_match.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    tag = tag.strip('"')
+    if not tag.startswith("v") or not tag[1:].isdigit():
+        raise HTTPException(status_code=400, detail="Malformed If-Match")
+    return int(tag[1:])
+
+def version_filter(version: int) -> dict:
+    # Documents written before versioning have no field and count as version 0
+    return {"version": version} if version else {"version": {"$in": [0, None]}}
+
+async def raise_missing_or_conflict(collection, query: dict, expected: Optional[int], not_found: str):
+    """Only reached when a guarded write matched nothing: say why"""
+    if expected is not None and await collection.find_one(query, {"_id": 1}):
+        raise HTTPException(status_code=412, detail="Modified by someone else; reload and retry")
+    raise HTTPException(status_code=404, detail=not_found)
+
+async def versioned_update(collection, query: dict, update_data: dict, expected: Optional[int], not_found: str) -> dict:
+    """$set the fields and bump the version in one round-trip; returns the new document"""
+    guarded = {**query, **version_filter(expected)} if expected is not None else query
+    if update_data:
+        doc = await collection.find_one_and_update(
+            guarded,
+            {"$set": update_data, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    else:
+        doc = await collection.find_one(guarded, {"_id": 0})
+    if doc is None:
+        await raise_missing_or_conflict(collection, query, expected, not_found)
+    return doc
+
+async def versioned_delete(collection, query: dict, expected: Optional[int], not_found: str):
+    guarded = {**query, **version_filter(expected)} if expected is not None else query
+    result = await collection.delete_one(guarded)
+    if not result.deleted_count:
+        await raise_missing_or_conflict(collection, query, expected, not_found)
+
 # ===== CALENDAR ROUTES =====
+# Read-validate-write rounds an update without If-Match gets against concurrent edits
+EVENT_UPDATE_RETRIES = int(os.environ.get('EVENT_UPDATE_RETRIES', '5'))
+
 @api_router.post("/servers/{server_id}/events", response_model=CalendarEvent)
 async def create_event(server_id: str, request: CreateEventRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
     """Create a calendar event"""
@@ -524,9 +1561,9 @@ async def create_event(server_id: str, request: CreateEventRequest, authorizatio
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    server = await db.servers.find_one({"id": server_id})
-    if not server or user.id not in server["members"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    await require_server_member(server_id, user)
+    if as_utc(request.end_time) < as_utc(request.start_time):
+        raise HTTPException(status_code=400, detail="end_time must not be before start_time")
     
     event = CalendarEvent(
         id=str(uuid.uuid4()),
@@ -538,79 +1575,121 @@ async def create_event(server_id: str, request: CreateEventRequest, authorizatio
         assigned_to=request.assigned_to,
         color=request.color,
         channel_link=request.channel_link,
+        recurrence=request.recurrence or None,
+        recurrence_end=recurrence_end(request.recurrence, request.start_time, request.end_time),
         created_by=user.id,
         created_at=datetime.now(timezone.utc)
     )
     await db.calendar_events.insert_one(event.dict())
+    agenda_cache.invalidate_tag(server_id)
     return event
 
 @api_router.get("/servers/{server_id}/events", response_model=List[CalendarEvent])
 async def get_events(server_id: str, start_date: Optional[str] = None, end_date: Optional[str] = None, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
-    """Get all events for a server (optionally filtered by date range)"""
+    """Get all events for a server.
+
+    With a start_date/end_date window, returns every event that overlaps it,
+    and recurring events are expanded into their occurrences in the window.
+    Without one, returns the stored events, with each series as a single row.
+    """
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    server = await db.servers.find_one({"id": server_id})
-    if not server or user.id not in server["members"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    await require_server_member(server_id, user)
     
-    query = {"server_id": server_id}
-    if start_date and end_date:
-        query["start_time"] = {
-            "$gte": datetime.fromisoformat(start_date),
-            "$lte": datetime.fromisoformat(end_date)
-        }
+    if not (start_date and end_date):
+        events = await db.calendar_events.find({"server_id": server_id}, {"_id": 0}).sort("start_time", 1).to_list(1000)
+        return [CalendarEvent(**e) for e in events]
     
-    events = await db.calendar_events.find(query).sort("start_time", 1).to_list(1000)
-    return [CalendarEvent(**e) for e in events]
+    window_start, window_end = parse_window(start_date, end_date)
+    result = []
+    async for e in db.calendar_events.find(overlap_query(server_id, window_start, window_end), {"_id": 0}):
+        if e.get("recurrence"):
+            result.extend(expand_occurrences(e, window_start, window_end))
+        else:
+            result.append(CalendarEvent(**e))
+    result.sort(key=lambda e: as_utc(e.start_time))
+    return result
 
 @api_router.get("/servers/{server_id}/events/{event_id}", response_model=CalendarEvent)
-async def get_event(server_id: str, event_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def get_event(server_id: str, event_id: str, response: Response, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
     """Get a specific event"""
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
+    await require_server_member(server_id, user)
+    
     event = await db.calendar_events.find_one({"id": event_id, "server_id": server_id})
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
     
-    return CalendarEvent(**event)
+    event = CalendarEvent(**event)
+    response.headers["ETag"] = version_etag(event.version)
+    return event
 
 @api_router.put("/servers/{server_id}/events/{event_id}", response_model=CalendarEvent)
-async def update_event(server_id: str, event_id: str, request: UpdateEventRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def update_event(
+    server_id: str,
+    event_id: str,
+    request: UpdateEventRequest,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
     """Update a calendar event"""
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    event = await db.calendar_events.find_one({"id": event_id, "server_id": server_id})
-    if not event:
-        raise HTTPException(status_code=404, detail="Event not found")
+    await require_server_member(server_id, user)
     
+    query = {"id": event_id, "server_id": server_id}
+    expected = if_match_version(if_match)
     update_data = {k: v for k, v in request.dict().items() if v is not None}
-    if update_data:
-        await db.calendar_events.update_one(
-            {"id": event_id},
-            {"$set": update_data}
-        )
-    
-    updated_event = await db.calendar_events.find_one({"id": event_id})
-    return CalendarEvent(**updated_event)
+    if update_data.get("recurrence") == "":
+        update_data["recurrence"] = None
+    if {"start_time", "end_time", "recurrence"} & update_data.keys():
+        # recurrence_end depends on fields the request may not carry, so this
+        # case reads first and then writes guarded by the version it read.
+        # Without If-Match that guard is ours, not the client's: losing it to
+        # a concurrent edit means read again, not 412.
+        for attempt in range(EVENT_UPDATE_RETRIES):
+            event = await db.calendar_events.find_one(query, {"_id": 0})
+            if not event:
+                raise HTTPException(status_code=404, detail="Event not found")
+            merged = {**event, **update_data}
+            if as_utc(merged["end_time"]) < as_utc(merged["start_time"]):
+                raise HTTPException(status_code=400, detail="end_time must not be before start_time")
+            update_data["recurrence_end"] = recurrence_end(merged.get("recurrence"), merged["start_time"], merged["end_time"])
+            guard = event.get("version", 0) if expected is None else expected
+            try:
+                event = await versioned_update(db.calendar_events, query, update_data, guard, "Event not found")
+                break
+            except HTTPException as e:
+                if e.status_code != 412 or expected is not None:
+                    raise
+        else:
+            raise HTTPException(status_code=409, detail="Event is being edited concurrently; retry")
+    else:
+        event = await versioned_update(db.calendar_events, query, update_data, expected, "Event not found")
+    agenda_cache.invalidate_tag(server_id)
+    response.headers["ETag"] = version_etag(event.get("version", 0))
+    return CalendarEvent(**event)
 
 @api_router.delete("/servers/{server_id}/events/{event_id}")
-async def delete_event(server_id: str, event_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def delete_event(server_id: str, event_id: str, if_match: Optional[str] = Header(None), authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
     """Delete a calendar event"""
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    event = await db.calendar_events.find_one({"id": event_id, "server_id": server_id})
-    if not event:
-        raise HTTPException(status_code=404, detail="Event not found")
+    await require_server_member(server_id, user)
     
-    await db.calendar_events.delete_one({"id": event_id})
+    await versioned_delete(db.calendar_events, {"id": event_id, "server_id": server_id}, if_match_version(if_match), "Event not found")
+    agenda_cache.invalidate_tag(server_id)
     return {"success": True}
 
 # ===== TASK ROUTES =====
@@ -621,9 +1700,7 @@ async def create_task(server_id: str, request: CreateTaskRequest, authorization:
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    server = await db.servers.find_one({"id": server_id})
-    if not server or user.id not in server["members"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    await require_server_member(server_id, user)
     
     task = Task(
         id=str(uuid.uuid4()),
@@ -638,6 +1715,7 @@ async def create_task(server_id: str, request: CreateTaskRequest, authorization:
         updated_at=datetime.now(timezone.utc)
     )
     await db.tasks.insert_one(task.dict())
+    agenda_cache.invalidate_tag(server_id)
     return task
 
 @api_router.get("/servers/{server_id}/tasks", response_model=List[Task])
@@ -647,9 +1725,7 @@ async def get_tasks(server_id: str, completed: Optional[bool] = None, authorizat
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    server = await db.servers.find_one({"id": server_id})
-    if not server or user.id not in server["members"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    await require_server_member(server_id, user)
     
     query = {"server_id": server_id}
     if completed is not None:
@@ -658,55 +1734,488 @@ async def get_tasks(server_id: str, completed: Optional[bool] = None, authorizat
     tasks = await db.tasks.find(query).sort("created_at", -1).to_list(1000)
     return [Task(**t) for t in tasks]
 
+BOARD_DEFAULT_FIELDS = ["title", "assigned_to", "deadline", "completed", "priority", "progress", "updated_at"]
+
+@api_router.get("/servers/{server_id}/tasks/board")
+async def get_task_board(
+    server_id: str,
+    assignee: Optional[str] = None,
+    priority: Optional[str] = None,
+    completed: Optional[bool] = None,
+    overdue: Optional[bool] = None,
+    deadline_from: Optional[datetime] = None,
+    deadline_to: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
+    """Filtered, projected page of tasks plus per-priority and per-status counts.
+
+    One aggregation: the filters run once, then a $facet produces the page
+    (keyset on created_at/id, newest first, continued via `next_cursor`)
+    and both group-by counts over the whole filtered set.
+    `fields` is a comma-separated list of Task fields; id and created_at
+    are always included.
+    """
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    await require_server_member(server_id, user)
+    
+    now = datetime.now(timezone.utc)
+    match = {"server_id": server_id}
+    if assignee:
+        match["assigned_to"] = assignee
+    if priority:
+        match["priority"] = priority
+    if completed is not None:
+        match["completed"] = completed
+    if deadline_from or deadline_to:
+        match["deadline"] = {}
+        if deadline_from:
+            match["deadline"]["$gte"] = deadline_from
+        if deadline_to:
+            match["deadline"]["$lte"] = deadline_to
+    overdue_match = {"completed": False, "deadline": {"$lt": now}}
+    if overdue is True:
+        match = {"$and": [match, overdue_match]}
+    elif overdue is False:
+        match = {"$and": [match, {"$nor": [overdue_match]}]}
+    
+    requested = [f.strip() for f in fields.split(",") if f.strip()] if fields else BOARD_DEFAULT_FIELDS
+    unknown = [f for f in requested if f not in Task.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    projection = {"_id": 0, "id": 1, "created_at": 1, **{f: 1 for f in requested}}
+    
+    limit = max(1, min(limit, 200))
+    page = [
+        {"$sort": {"created_at": -1, "id": -1}},
+        {"$limit": limit + 1},
+        {"$project": projection},
+    ]
+    if cursor:
+        page.insert(0, {"$match": keyset_filter("created_at", cursor, older=True)})
+    status = {"$switch": {
+        "branches": [
+            {"case": "$completed", "then": "completed"},
+            {"case": {"$lt": [{"$ifNull": ["$deadline", now]}, now]}, "then": "overdue"},
+        ],
+        "default": "open",
+    }}
+    
+    result = await db.tasks.aggregate([
+        {"$match": match},
+        {"$facet": {
+            "tasks": page,
+            "by_priority": [{"$group": {"_id": "$priority", "count": {"$sum": 1}}}],
+            "by_status": [{"$group": {"_id": status, "count": {"$sum": 1}}}],
+        }},
+    ]).to_list(1)
+    board = result[0]
+    
+    tasks = board["tasks"][:limit]
+    next_cursor = None
+    if len(board["tasks"]) > limit:
+        next_cursor = encode_cursor(tasks[-1]["created_at"], tasks[-1]["id"])
+    by_priority = {g["_id"]: g["count"] for g in board["by_priority"]}
+    return {
+        "tasks": tasks,
+        "next_cursor": next_cursor,
+        "counts": {
+            "total": sum(by_priority.values()),
+            "priority": by_priority,
+            "status": {g["_id"]: g["count"] for g in board["by_status"]},
+        },
+    }
+
 @api_router.get("/servers/{server_id}/tasks/{task_id}", response_model=Task)
-async def get_task(server_id: str, task_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def get_task(server_id: str, task_id: str, response: Response, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
     """Get a specific task"""
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
+    await require_server_member(server_id, user)
+    
     task = await db.tasks.find_one({"id": task_id, "server_id": server_id})
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    return Task(**task)
+    task = Task(**task)
+    response.headers["ETag"] = version_etag(task.version)
+    return task
 
 @api_router.put("/servers/{server_id}/tasks/{task_id}", response_model=Task)
-async def update_task(server_id: str, task_id: str, request: UpdateTaskRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def update_task(
+    server_id: str,
+    task_id: str,
+    request: UpdateTaskRequest,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
     """Update a task"""
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    task = await db.tasks.find_one({"id": task_id, "server_id": server_id})
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
+    await require_server_member(server_id, user)
     
     update_data = {k: v for k, v in request.dict().items() if v is not None}
     if update_data:
         update_data["updated_at"] = datetime.now(timezone.utc)
-        await db.tasks.update_one(
-            {"id": task_id},
-            {"$set": update_data}
-        )
     
-    updated_task = await db.tasks.find_one({"id": task_id})
-    return Task(**updated_task)
+    task = await versioned_update(db.tasks, {"id": task_id, "server_id": server_id}, update_data, if_match_version(if_match), "Task not found")
+    agenda_cache.invalidate_tag(server_id)
+    response.headers["ETag"] = version_etag(task.get("version", 0))
+    return Task(**task)
 
 @api_router.delete("/servers/{server_id}/tasks/{task_id}")
-async def delete_task(server_id: str, task_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def delete_task(server_id: str, task_id: str, if_match: Optional[str] = Header(None), authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
     """Delete a task"""
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    task = await db.tasks.find_one({"id": task_id, "server_id": server_id})
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
+    await require_server_member(server_id, user)
     
-    await db.tasks.delete_one({"id": task_id})
+    await versioned_delete(db.tasks, {"id": task_id, "server_id": server_id}, if_match_version(if_match), "Task not found")
+    agenda_cache.invalidate_tag(server_id)
     return {"success": True}
 
+# ===== SUB-TASK ROUTES =====
+# Each operation is one find_one_and_update with an update pipeline: the
+# sub_tasks edit and the progress recount happen in the same atomic write,
+# so concurrent checkbox clicks cannot overwrite each other. User input is
+# wrapped in $literal so a leading "$" is never read as a field path.
+def _subtasks_where(cond: dict) -> dict:
+    return {"$filter": {"input": {"$ifNull": ["$sub_tasks", []]}, "cond": cond}}
+
+SUBTASK_PROGRESS_STAGE = {"$set": {"progress": {"$cond": [
+    {"$gt": [{"$size": "$sub_tasks"}, 0]},
+    {"$toInt": {"$round": [{"$multiply": [100, {"$divide": [
+        {"$size": _subtasks_where("$$this.completed")},
+        {"$size": "$sub_tasks"},
+    ]}]}, 0]}},
+    # Only sub-task edits run this stage, so an empty list means the last one
+    # was just removed: its count no longer applies
+    {"$cond": [{"$eq": ["$completed", True]}, 100, 0]},
+]}}}
+
+async def update_subtasks(server_id: str, task_id: str, sub_tasks_expr: dict, sub_task_id: Optional[str] = None) -> Task:
+    """Replace sub_tasks with an expression over the current array, recount progress, return the task"""
+    query = {"id": task_id, "server_id": server_id}
+    if sub_task_id is not None:
+        query["sub_tasks.id"] = sub_task_id
+    task = await db.tasks.find_one_and_update(
+        query,
+        [
+            {"$set": {
+                "sub_tasks": sub_tasks_expr,
+                "updated_at": datetime.now(timezone.utc),
+                "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+            }},
+            SUBTASK_PROGRESS_STAGE,
+        ],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not task:
+        raise HTTPException(status_code=404, detail="Sub-task not found" if sub_task_id else "Task not found")
+    agenda_cache.invalidate_tag(server_id)
+    return Task(**task)
+
+@api_router.post("/servers/{server_id}/tasks/{task_id}/subtasks", response_model=Task)
+async def add_subtask(server_id: str, task_id: str, request: CreateSubTaskRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Append a sub-task"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    await require_server_member(server_id, user)
+    
+    sub_task = SubTask(id=str(uuid.uuid4()), title=request.title)
+    return await update_subtasks(server_id, task_id, {"$concatArrays": [
+        {"$ifNull": ["$sub_tasks", []]},
+        {"$literal": [sub_task.dict()]},
+    ]})
+
+@api_router.patch("/servers/{server_id}/tasks/{task_id}/subtasks/{sub_task_id}", response_model=Task)
+async def update_subtask(server_id: str, task_id: str, sub_task_id: str, request: UpdateSubTaskRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Rename, tick or untick a sub-task; with an empty body, toggle it"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    await require_server_member(server_id, user)
+    
+    changes = {}
+    if request.title is not None:
+        changes["title"] = {"$literal": request.title}
+    if request.completed is not None:
+        changes["completed"] = request.completed
+    elif request.title is None:
+        changes["completed"] = {"$not": ["$$this.completed"]}
+    
+    return await update_subtasks(server_id, task_id, {"$map": {
+        "input": "$sub_tasks",
+        "in": {"$cond": [
+            {"$eq": ["$$this.id", {"$literal": sub_task_id}]},
+            {"$mergeObjects": ["$$this", changes]},
+            "$$this",
+        ]},
+    }}, sub_task_id)
+
+@api_router.post("/servers/{server_id}/tasks/{task_id}/subtasks/{sub_task_id}/move", response_model=Task)
+async def move_subtask(server_id: str, task_id: str, sub_task_id: str, request: MoveSubTaskRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Move a sub-task to a new position (clamped to the end of the list)"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if request.index < 0:
+        raise HTTPException(status_code=400, detail="index must not be negative")
+    
+    await require_server_member(server_id, user)
+    
+    target = {"$literal": sub_task_id}
+    return await update_subtasks(server_id, task_id, {"$let": {
+        "vars": {
+            "moved": {"$arrayElemAt": [_subtasks_where({"$eq": ["$$this.id", target]}), 0]},
+            "rest": _subtasks_where({"$ne": ["$$this.id", target]}),
+        },
+        "in": {"$concatArrays": [
+            {"$slice": ["$$rest", request.index]},
+            ["$$moved"],
+            {"$slice": ["$$rest", request.index, {"$add": [{"$size": "$$rest"}, 1]}]},
+        ]},
+    }}, sub_task_id)
+
+@api_router.delete("/servers/{server_id}/tasks/{task_id}/subtasks/{sub_task_id}", response_model=Task)
+async def delete_subtask(server_id: str, task_id: str, sub_task_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Remove a sub-task"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    await require_server_member(server_id, user)
+    
+    return await update_subtasks(server_id, task_id, _subtasks_where({"$ne": ["$$this.id", {"$literal": sub_task_id}]}), sub_task_id)
+
+# ===== COLLABORATIVE NOTES =====
+# Editors send note_ot operations over /ws/notes/{note_id} instead of whole
+# bodies. Each accepted op is logged in note_ops under the next revision; the
+# unique (note_id, revision) index means two workers can never both claim one.
+# notes.content is a snapshot at notes.revision, refreshed every
+# NOTE_SNAPSHOT_INTERVAL ops and when the last local editor leaves.
+NOTE_SNAPSHOT_INTERVAL = int(os.environ.get('NOTE_SNAPSHOT_INTERVAL', '100'))
+# Ops kept behind the snapshot (and in memory) so lagging editors can be rebased
+NOTE_OP_RETENTION = int(os.environ.get('NOTE_OP_RETENTION', '500'))
+
+class NoteResync(Exception):
+    """An op's base revision is outside the history we can rebase against"""
+
+class NoteDeleted(Exception):
+    """The note was deleted while an editor still had it open"""
+
+class NoteSession:
+    """The live text of one note on this worker plus its recent op history"""
+
+    def __init__(self, note: dict):
+        self.note_id = note["id"]
+        self.server_id = note["server_id"]
+        self.collaborative = note.get("collaborative", True)
+        self._reset(note)
+        self.last_editor: Optional[str] = None
+        self.lock = asyncio.Lock()
+        self.closed = False  # set once the note is deleted; no further ops are logged
+
+    def _reset(self, note: dict):
+        self.content = note.get("content", "")
+        self.revision = note.get("revision", 0)
+        self.snapshot_revision = self.revision
+        self.history: deque = deque(maxlen=NOTE_OP_RETENTION)  # (revision, op), oldest first
+
+    def _record(self, revision: int, op: list, content: str):
+        self.history.append((revision, op))
+        self.content = content
+        self.revision = revision
+
+    async def catch_up(self):
+        """Apply ops that other workers logged after our revision"""
+        cursor = db.note_ops.find(
+            {"note_id": self.note_id, "revision": {"$gt": self.revision}},
+            {"_id": 0, "revision": 1, "op": 1}
+        ).sort("revision", ASCENDING)
+        async for entry in cursor:
+            if entry["revision"] != self.revision + 1:
+                # We fell behind a pruned stretch of the log: start over from the snapshot
+                note = await db.notes.find_one({"id": self.note_id}, {"_id": 0})
+                if note:
+                    self._reset(note)
+                    await self.catch_up()
+                return
+            self._record(entry["revision"], entry["op"], note_ot.apply(self.content, entry["op"]))
+
+    def rebase(self, op: list, base_revision: int) -> list:
+        """Transform an op written against base_revision past everything accepted since"""
+        if base_revision > self.revision:
+            raise NoteResync()
+        if base_revision < self.revision and (not self.history or self.history[0][0] > base_revision + 1):
+            raise NoteResync()
+        for revision, concurrent in self.history:
+            if revision > base_revision:
+                op, _ = note_ot.transform(op, concurrent)
+        return op
+
+    async def _commit(self, op: list, base_revision: int, user_id: str) -> tuple:
+        while True:
+            if self.closed:
+                raise NoteDeleted()
+            rebased = self.rebase(op, base_revision)
+            content = note_ot.apply(self.content, rebased)
+            revision = self.revision + 1
+            try:
+                await db.note_ops.insert_one({
+                    "note_id": self.note_id,
+                    "revision": revision,
+                    "op": rebased,
+                    "user_id": user_id,
+                    "created_at": datetime.now(timezone.utc),
+                })
+            except DuplicateKeyError:
+                # Another worker took this revision first; pull its ops and rebase again
+                await self.catch_up()
+                continue
+            self._record(revision, rebased, content)
+            self.last_editor = user_id
+            return revision, rebased
+
+    async def submit(self, op: list, base_revision: int, user_id: str) -> tuple:
+        """Accept an editor's op; returns (revision, op as applied)"""
+        async with self.lock:
+            if base_revision > self.revision:
+                await self.catch_up()
+            return await self._commit(op, base_revision, user_id)
+
+    async def replace(self, content: str, user_id: str) -> Optional[tuple]:
+        """Turn a whole-body save into a diff against the live text"""
+        async with self.lock:
+            await self.catch_up()
+            op = note_ot.replace(self.content, content)
+            if op == ([len(self.content)] if self.content else []):
+                return None
+            return await self._commit(op, self.revision, user_id)
+
+    async def snapshot(self, fields: Optional[dict] = None) -> Optional[dict]:
+        """Fold the live text into notes.content and prune ops it covers"""
+        async with self.lock:
+            if self.revision == self.snapshot_revision and not fields:
+                return None
+            update = {"content": self.content, "revision": self.revision, "updated_at": datetime.now(timezone.utc)}
+            if self.last_editor:
+                update["updated_by"] = self.last_editor
+            update.update(fields or {})
+            # Never roll back a newer snapshot written by another worker
+            note = await db.notes.find_one_and_update(
+                {"id": self.note_id, "revision": {"$not": {"$gt": self.revision}}},
+                {"$set": update, "$inc": {"version": 1}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+            self.snapshot_revision = self.revision
+            await db.note_ops.delete_many({"note_id": self.note_id, "revision": {"$lte": self.revision - NOTE_OP_RETENTION}})
+            return note
+
+note_sessions: Dict[str, NoteSession] = {}
+note_sessions_lock = asyncio.Lock()
+
+def note_channel(note_id: str) -> str:
+    return f"note:{note_id}"
+
+async def open_note_session(note_id: str) -> Optional[NoteSession]:
+    session = note_sessions.get(note_id)
+    if session:
+        return session
+    async with note_sessions_lock:
+        session = note_sessions.get(note_id)
+        if session is None:
+            note = await db.notes.find_one({"id": note_id}, {"_id": 0})
+            if note is None:
+                return None
+            session = NoteSession(note)
+            await session.catch_up()
+            note_sessions[note_id] = session
+        return session
+
+async def release_note_session(note_id: str):
+    """Snapshot and drop the session once no editor on this worker has it open"""
+    if manager.active_connections.get(note_channel(note_id)):
+        return
+    session = note_sessions.pop(note_id, None)
+    if session:
+        await session.snapshot()
+
+async def close_note_session(note_id: str):
+    """Stop a deleted note's session taking ops, then drop every op logged for it"""
+    session = note_sessions.pop(note_id, None)
+    if session:
+        session.closed = True
+        async with session.lock:
+            pass  # an op already being written lands before the cleanup below
+    await db.note_ops.delete_many({"note_id": note_id})
+
+def note_channel_event(channel: str, message: str):
+    """Broker observer: close this worker's session when another worker deletes the note"""
+    note_id = channel[len("note:"):]
+    if note_id in note_sessions and '"deleted"' in message and json.loads(message).get("type") == "deleted":
+        asyncio.create_task(close_note_session(note_id))
+
+async def publish_note_op(note_id: str, revision: int, op: list, user_id: str, client_id: Optional[str]):
+    # The originating editor recognises its client_id and treats this as its ack
+    await manager.broadcast(json.dumps({
+        "type": "op",
+        "revision": revision,
+        "op": op,
+        "user_id": user_id,
+        "client_id": client_id,
+    }), note_channel(note_id))
+
+async def live_note(note: dict) -> dict:
+    """Fold ops logged since the note's last snapshot into its content"""
+    ops = await db.note_ops.find(
+        {"note_id": note["id"], "revision": {"$gt": note.get("revision", 0)}},
+        {"_id": 0, "revision": 1, "op": 1}
+    ).sort("revision", ASCENDING).to_list(None)
+    content, revision = note.get("content", ""), note.get("revision", 0)
+    for entry in ops:
+        if entry["revision"] != revision + 1:
+            break
+        content, revision = note_ot.apply(content, entry["op"]), entry["revision"]
+    return {**note, "content": content, "revision": revision}
+
+async def save_note_content(server_id: str, note_id: str, content: str, fields: dict, expected: Optional[int], user_id: str) -> dict:
+    """REST save of a whole body: logged as a diff so it merges with live editors"""
+    query = {"id": note_id, "server_id": server_id}
+    if expected is not None and not await db.notes.find_one({**query, **version_filter(expected)}, {"_id": 1}):
+        await raise_missing_or_conflict(db.notes, query, expected, "Note not found")
+    session = await open_note_session(note_id)
+    if session is None or session.server_id != server_id:
+        raise HTTPException(status_code=404, detail="Note not found")
+    try:
+        committed = await session.replace(content, user_id)
+    except NoteDeleted:
+        raise HTTPException(status_code=404, detail="Note not found")
+    if committed:
+        await publish_note_op(note_id, *committed, user_id, None)
+    note = await session.snapshot(fields)
+    await release_note_session(note_id)
+    return note or await versioned_update(db.notes, query, fields, None, "Note not found")
+
 # ===== NOTES ROUTES =====
 @api_router.post("/servers/{server_id}/notes", response_model=Note)
 async def create_note(server_id: str, request: CreateNoteRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
@@ -715,9 +2224,7 @@ async def create_note(server_id: str, request: CreateNoteRequest, authorization:
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    server = await db.servers.find_one({"id": server_id})
-    if not server or user.id not in server["members"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    await require_server_member(server_id, user)
     
     note = Note(
         id=str(uuid.uuid4()),
@@ -740,95 +2247,773 @@ async def get_notes(server_id: str, authorization: Optional[str] = Header(None),
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    server = await db.servers.find_one({"id": server_id})
-    if not server or user.id not in server["members"]:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    await require_server_member(server_id, user)
     
     notes = await db.notes.find({"server_id": server_id}).sort("updated_at", -1).to_list(1000)
+    # Notes open in an editor on this worker may be ahead of their snapshot
+    for n in notes:
+        session = note_sessions.get(n["id"])
+        if session and session.revision > n.get("revision", 0):
+            n.update(content=session.content, revision=session.revision)
     return [Note(**n) for n in notes]
 
 @api_router.get("/servers/{server_id}/notes/{note_id}", response_model=Note)
-async def get_note(server_id: str, note_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def get_note(server_id: str, note_id: str, response: Response, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
     """Get a specific note"""
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
+    await require_server_member(server_id, user)
+    
     note = await db.notes.find_one({"id": note_id, "server_id": server_id})
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
     
-    return Note(**note)
+    note = Note(**await live_note(note))
+    response.headers["ETag"] = version_etag(note.version)
+    return note
 
 @api_router.put("/servers/{server_id}/notes/{note_id}", response_model=Note)
-async def update_note(server_id: str, note_id: str, request: UpdateNoteRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def update_note(
+    server_id: str,
+    note_id: str,
+    request: UpdateNoteRequest,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
     """Update a note"""
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    note = await db.notes.find_one({"id": note_id, "server_id": server_id})
-    if not note:
-        raise HTTPException(status_code=404, detail="Note not found")
+    await require_server_member(server_id, user)
     
     update_data = {k: v for k, v in request.dict().items() if v is not None}
-    if update_data:
+    content = update_data.pop("content", None)
+    if update_data or content is not None:
         update_data["updated_by"] = user.id
         update_data["updated_at"] = datetime.now(timezone.utc)
-        await db.notes.update_one(
-            {"id": note_id},
-            {"$set": update_data}
-        )
     
-    updated_note = await db.notes.find_one({"id": note_id})
-    return Note(**updated_note)
+    expected = if_match_version(if_match)
+    if content is None:
+        note = await versioned_update(db.notes, {"id": note_id, "server_id": server_id}, update_data, expected, "Note not found")
+    else:
+        note = await save_note_content(server_id, note_id, content, update_data, expected, user.id)
+    response.headers["ETag"] = version_etag(note.get("version", 0))
+    return Note(**note)
 
 @api_router.delete("/servers/{server_id}/notes/{note_id}")
-async def delete_note(server_id: str, note_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def delete_note(server_id: str, note_id: str, if_match: Optional[str] = Header(None), authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
     """Delete a note"""
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    note = await db.notes.find_one({"id": note_id, "server_id": server_id})
-    if not note:
-        raise HTTPException(status_code=404, detail="Note not found")
+    await require_server_member(server_id, user)
     
-    await db.notes.delete_one({"id": note_id})
+    await versioned_delete(db.notes, {"id": note_id, "server_id": server_id}, if_match_version(if_match), "Note not found")
+    await close_note_session(note_id)
+    # Other workers close their own sessions when this reaches them
+    await manager.broadcast(json.dumps({"type": "deleted"}), note_channel(note_id))
     return {"success": True}
 
 
+# ===== AGENDA =====
+async def merge_by_time(*streams):
+    """Lazy k-way merge of async iterators that each yield (time, item) in time order"""
+    iterators = [stream.__aiter__() for stream in streams]
+    heap = []
+    for index, iterator in enumerate(iterators):
+        try:
+            when, item = await iterator.__anext__()
+            heap.append((when, index, item))
+        except StopAsyncIteration:
+            pass
+    heapq.heapify(heap)
+    while heap:
+        when, index, item = heap[0]
+        yield item
+        try:
+            next_when, next_item = await iterators[index].__anext__()
+            heapq.heapreplace(heap, (next_when, index, next_item))
+        except StopAsyncIteration:
+            heapq.heappop(heap)
+
+async def _agenda_events(query: dict):
+    async for e in db.calendar_events.find(query, {"_id": 0}).sort("start_time", 1):
+        event = CalendarEvent(**e)
+        yield as_utc(event.start_time), AgendaItem(kind="event", time=event.start_time, server_id=event.server_id, event=event)
+
+async def _agenda_occurrences(series: dict, window_start: datetime, window_end: datetime):
+    for event in expand_occurrences(series, window_start, window_end):
+        yield as_utc(event.start_time), AgendaItem(kind="event", time=event.start_time, server_id=event.server_id, event=event)
+
+async def _agenda_tasks(query: dict):
+    async for t in db.tasks.find(query, {"_id": 0}).sort("deadline", 1):
+        task = Task(**t)
+        yield as_utc(task.deadline), AgendaItem(kind="task", time=task.deadline, server_id=task.server_id, task=task)
+
+@api_router.get("/agenda", response_model=List[AgendaItem])
+async def get_agenda(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    include_completed: bool = False,
+    limit: int = 500,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
+    """The current user's assigned events and task deadlines across all their servers, in time order.
+
+    Defaults to the next seven days.
+    """
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    if start_date and end_date:
+        window_start, window_end = parse_window(start_date, end_date)
+    else:
+        # Truncated so that repeated "my week" requests share a cache key
+        window_start = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+        window_end = window_start + timedelta(days=7)
+    limit = max(1, min(limit, 1000))
+    
+    cache_key = (user.id, window_start, window_end, include_completed, limit)
+    cached = agenda_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    servers = await db.servers.find({"members": user.id}, {"_id": 0, "id": 1}).to_list(None)
+    server_ids = [srv["id"] for srv in servers]
+    
+    in_scope = {"assigned_to": user.id, "server_id": {"$in": server_ids}}
+    series = await db.calendar_events.find({
+        **in_scope,
+        "recurrence": {"$ne": None},
+        "start_time": {"$lt": window_end},
+        "$or": [{"recurrence_end": None}, {"recurrence_end": {"$gt": window_start}}],
+    }, {"_id": 0}).to_list(None)
+    task_query = {**in_scope, "deadline": {"$gte": window_start, "$lt": window_end}}
+    if not include_completed:
+        task_query["completed"] = False
+    
+    streams = [
+        _agenda_events({**in_scope, "recurrence": None, "start_time": {"$lt": window_end}, "end_time": {"$gt": window_start}}),
+        _agenda_tasks(task_query),
+        *(_agenda_occurrences(e, window_start, window_end) for e in series),
+    ]
+    items = []
+    async for item in merge_by_time(*streams):
+        items.append(item)
+        if len(items) >= limit:
+            break
+    
+    agenda_cache.set(cache_key, items, tags=server_ids)
+    return items
+
+# ===== UPLOADS =====
+# Files stream to disk through a worker thread and are stored content-addressed
+# as {sha256}{ext}, so uploading the same bytes twice keeps one copy. Large
+# files go through resumable upload sessions that append the raw request body
+# chunk by chunk at a client-supplied offset.
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+UPLOAD_SESSION_TTL = timedelta(hours=int(os.environ.get('UPLOAD_SESSION_TTL_HOURS', '24')))
+PARTIAL_UPLOAD_FOLDER = UPLOAD_FOLDER / ".partial"
+os.makedirs(PARTIAL_UPLOAD_FOLDER, exist_ok=True)
+
+def upload_extension(filename: Optional[str]) -> str:
+    """Lower-cased extension if it is a plain one (kept so browsers can sniff the type)"""
+    ext = Path(filename or "").suffix.lower()
+    return ext if 1 < len(ext) <= 10 and ext[1:].isalnum() else ""
+
+class ChunkWriter:
+    """Writes chunks to a file from a worker thread so disk I/O never blocks the event loop"""
+
+    def __init__(self, path: Path, offset: int = 0, limit: int = MAX_UPLOAD_BYTES, hasher=None):
+        self.path = path
+        self.size = offset
+        self.limit = limit
+        self.hasher = hasher
+        self._file = None
+
+    def _open(self):
+        f = open(self.path, "r+b" if self.size else "wb")
+        # Drop anything a broken earlier request wrote past the recorded offset
+        f.seek(self.size)
+        f.truncate()
+        return f
+
+    async def __aenter__(self):
+        self._file = await asyncio.to_thread(self._open)
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.to_thread(self._file.close)
+
+    async def write(self, chunk: bytes):
+        if self.size + len(chunk) > self.limit:
+            raise HTTPException(status_code=413, detail="File too large")
+        if self.hasher:
+            self.hasher.update(chunk)
+        await asyncio.to_thread(self._file.write, chunk)
+        self.size += len(chunk)
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def commit_upload(temp_path: Path, sha256: str, ext: str) -> str:
+    """Move a finished temp file to its content address; duplicates are discarded"""
+    name = f"{sha256}{ext}"
+    target = UPLOAD_FOLDER / name
+    if target.exists():
+        temp_path.unlink()
+    else:
+        os.replace(temp_path, target)
+    return name
+
+def upload_result(name: str, sha256: str, size: int) -> dict:
+    return {"url": f"/api/uploads/{name}", "name": name, "sha256": sha256, "size": size}
+
+# Room for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+async def receive_multipart_file(request: Request, writer: ChunkWriter, field: str = "file") -> str:
+    """Push-parse a multipart body as it arrives, writing only `field`'s bytes; returns its filename.
+
+    Nothing is spooled first, so the writer's size limit fires as soon as
+    too many bytes have come in.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+    
+    # The parser calls back synchronously; collect events and write them out after each chunk
+    events = []
+    header = {"field": b"", "value": b""}
+    part_headers = {}
+    
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+    
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+    
+    def on_header_end():
+        part_headers[header["field"].lower()] = header["value"]
+        header["field"] = header["value"] = b""
+    
+    def on_headers_finished():
+        events.append(("part", dict(part_headers)))
+        part_headers.clear()
+    
+    def on_part_data(data, start, end):
+        events.append(("data", data[start:end]))
+    
+    parser = MultipartParser(params[b"boundary"], {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+    filename = None
+    in_file = False
+    async for chunk in request.stream():
+        parser.write(chunk)
+        for kind, value in events:
+            if kind == "part":
+                _, options = parse_options_header(value.get(b"content-disposition", b""))
+                in_file = filename is None and options.get(b"name") == field.encode() and b"filename" in options
+                if in_file:
+                    filename = options[b"filename"].decode("utf-8", "replace")
+            elif in_file:
+                await writer.write(value)
+        events.clear()
+    parser.finalize()
+    if filename is None:
+        raise HTTPException(status_code=400, detail=f"Missing '{field}' file field")
+    return filename
+
+def sweep_partial_uploads():
+    """Remove temp files of abandoned uploads (their sessions expire via TTL index)"""
+    cutoff = time.time() - UPLOAD_SESSION_TTL.total_seconds()
+    for path in PARTIAL_UPLOAD_FOLDER.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass
+
 @api_router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    file_location = UPLOAD_FOLDER / file.filename
-    with open(file_location, "wb") as f:
-        f.write(await file.read())
-    url = f"/uploads/{file.filename}"
-    return JSONResponse({"url": url})
+async def upload_file(request: Request, background_tasks: BackgroundTasks, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Upload a file in one multipart request, field "file" (use upload sessions for large files)"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    # Refuse declared oversize bodies before reading a byte
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
+    
+    temp_path = PARTIAL_UPLOAD_FOLDER / str(uuid.uuid4())
+    try:
+        async with ChunkWriter(temp_path, hasher=hashlib.sha256()) as writer:
+            filename = await receive_multipart_file(request, writer)
+        sha256 = writer.hasher.hexdigest()
+        name = await asyncio.to_thread(commit_upload, temp_path, sha256, upload_extension(filename))
+    finally:
+        temp_path.unlink(missing_ok=True)
+    background_tasks.add_task(generate_derivatives, name, sha256)
+    return JSONResponse(upload_result(name, sha256, writer.size))
+
+@api_router.post("/uploads/sessions")
+async def create_upload_session(request: CreateUploadSessionRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Start a resumable upload; send the bytes with PUT .../sessions/{id}?offset=N"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    if request.size <= 0 or request.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
+    
+    await asyncio.to_thread(sweep_partial_uploads)
+    upload = {
+        "id": str(uuid.uuid4()),
+        "user_id": user.id,
+        "filename": request.filename,
+        "size": request.size,
+        "received": 0,
+        "expires_at": datetime.now(timezone.utc) + UPLOAD_SESSION_TTL,
+    }
+    await db.upload_sessions.insert_one(upload)
+    return {"id": upload["id"], "offset": 0, "size": request.size, "chunk_size": UPLOAD_CHUNK_SIZE}
+
+@api_router.get("/uploads/sessions/{upload_id}")
+async def get_upload_session(upload_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Where to resume an interrupted upload"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    upload = await db.upload_sessions.find_one({"id": upload_id, "user_id": user.id}, {"_id": 0})
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"id": upload_id, "offset": upload["received"], "size": upload["size"]}
+
+@api_router.put("/uploads/sessions/{upload_id}")
+async def upload_chunk(upload_id: str, offset: int, request: Request, background_tasks: BackgroundTasks, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Append the request body at `offset`; the last chunk finalises the file"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    # Claim the session at this offset so two concurrent PUTs cannot interleave
+    now = datetime.now(timezone.utc)
+    upload = await db.upload_sessions.find_one_and_update(
+        {"id": upload_id, "user_id": user.id, "received": offset, "writing_until": {"$not": {"$gt": now}}},
+        {"$set": {"writing_until": now + timedelta(minutes=10)}},
+        projection={"_id": 0}
+    )
+    if not upload:
+        current = await db.upload_sessions.find_one({"id": upload_id, "user_id": user.id}, {"_id": 0, "received": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        raise HTTPException(status_code=409, detail={"message": "Offset mismatch or upload in progress", "offset": current["received"]})
+    
+    temp_path = PARTIAL_UPLOAD_FOLDER / upload["id"]
+    writer = ChunkWriter(temp_path, offset=offset, limit=upload["size"])
+    try:
+        async with writer:
+            async for chunk in request.stream():
+                await writer.write(chunk)
+    finally:
+        # Whatever reached the disk counts, so a dropped connection resumes where it broke
+        await db.upload_sessions.update_one(
+            {"id": upload_id},
+            {"$set": {"received": writer.size, "writing_until": None, "expires_at": datetime.now(timezone.utc) + UPLOAD_SESSION_TTL}}
+        )
+    
+    if writer.size < upload["size"]:
+        return {"id": upload_id, "offset": writer.size, "size": upload["size"]}
+    
+    # Complete: hash the assembled file once and move it to its content address
+    sha256 = await asyncio.to_thread(file_sha256, temp_path)
+    name = await asyncio.to_thread(commit_upload, temp_path, sha256, upload_extension(upload["filename"]))
+    await db.upload_sessions.delete_one({"id": upload_id})
+    background_tasks.add_task(generate_derivatives, name, sha256)
+    return upload_result(name, sha256, writer.size)
+
+# Content-addressed files never change, so clients may cache them forever
+UPLOAD_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Files stored under their original name before content addressing
+LEGACY_UPLOAD_CACHE_CONTROL = "public, max-age=0, must-revalidate"
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[tuple]:
+    """(start, end) inclusive for a single "bytes=" range, None to send everything"""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None  # multi-range requests get the whole file, as RFC 9110 allows
+    first, _, last = header[6:].strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), int(last) if last else size - 1
+        else:
+            start, end = size - int(last), size - 1
+    except ValueError:
+        return None
+    start = max(start, 0)
+    end = min(end, size - 1)
+    if start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+class FileRangeResponse(Response):
+    """Sends bytes [start, end] of a file.
+
+    Uses the ASGI zero-copy send extension (sendfile) when the server offers
+    it, otherwise streams chunks read in a worker thread.
+    """
+
+    def __init__(self, path: Path, start: int, end: int, status_code: int, headers: dict, media_type: str, send_body: bool = True):
+        super().__init__(status_code=status_code, headers={**headers, "Content-Length": str(end - start + 1)}, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.send_body = send_body
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        if not self.send_body or count <= 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        f = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": f, "offset": self.start, "count": count})
+                return
+            await asyncio.to_thread(f.seek, self.start)
+            while count > 0:
+                chunk = await asyncio.to_thread(f.read, min(UPLOAD_CHUNK_SIZE, count))
+                if not chunk:
+                    break
+                count -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": count > 0})
+            if count > 0:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            await asyncio.to_thread(f.close)
+
+@api_router.api_route("/uploads/{name}", methods=["GET", "HEAD"])
+async def serve_upload(name: str, request: Request):
+    """Serve an uploaded file with ETag, long-lived caching and Range support"""
+    path = UPLOAD_FOLDER / name
+    try:
+        if name.startswith("."):
+            raise FileNotFoundError(name)
+        info = await asyncio.to_thread(os.stat, path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=404, detail="File not found")
+    if not stat.S_ISREG(info.st_mode):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    stem = name.split(".", 1)[0]
+    digest = stem.split("_", 1)[0]  # derivatives are named {sha256}_{variant}
+    if len(digest) == 64 and all(c in "0123456789abcdef" for c in digest):
+        etag, cache_control = f'"{stem}"', UPLOAD_CACHE_CONTROL
+    else:
+        etag, cache_control = f'W/"{int(info.st_mtime)}-{info.st_size}"', LEGACY_UPLOAD_CACHE_CONTROL
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Last-Modified": formatdate(info.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag.removeprefix("W/")):
+        return Response(status_code=304, headers=headers)
+    
+    size = info.st_size
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    # A Range is only honoured if the client's copy is still this one
+    if not if_range or (if_range.strip() == etag and not etag.startswith("W/")):
+        try:
+            byte_range = parse_byte_range(request.headers.get("range"), size)
+        except HTTPException as e:
+            e.headers = {**headers, **e.headers}
+            raise
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    send_body = request.method != "HEAD"
+    if byte_range is None:
+        return FileRangeResponse(path, 0, size - 1, 200, headers, media_type, send_body)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return FileRangeResponse(path, start, end, 206, headers, media_type, send_body)
+
+
+
+# ===== ATTACHMENT DERIVATIVES =====
+# Thumbnails, WebP variants and a blurhash for every image upload, built after
+# the response on a process pool so neither the request nor the event loop
+# pays for the decoding. THUMBNAIL_WORKERS bounds the CPU spent on it.
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', '2'))
+derivative_pool: Optional[ProcessPoolExecutor] = None
+
+def get_derivative_pool() -> ProcessPoolExecutor:
+    global derivative_pool
+    if derivative_pool is None:
+        # spawn: forking a process that runs Motor's threads is not safe
+        derivative_pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return derivative_pool
+
+async def generate_derivatives(name: str, sha256: str):
+    """Background task: build and record previews for an image upload once per content hash"""
+    if not image_derivatives.available() or not image_derivatives.is_image(name):
+        return
+    try:
+        claimed = await db.attachments.update_one(
+            {"sha256": sha256},
+            {"$setOnInsert": {"sha256": sha256, "name": name, "status": "pending", "created_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return
+    if not claimed.upserted_id:
+        return  # already generated (or being generated) for identical bytes
+    
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(get_derivative_pool(), image_derivatives.generate, str(UPLOAD_FOLDER / name), str(UPLOAD_FOLDER), sha256)
+        await db.attachments.update_one({"sha256": sha256}, {"$set": {**result, "status": "ready"}})
+    except Exception as e:
+        logger.error(f"Derivatives for {name} failed: {e}")
+        await db.attachments.update_one({"sha256": sha256}, {"$set": {"status": "failed"}})
 
+@api_router.get("/attachments/{sha256}", response_model=Attachment)
+async def get_attachment(sha256: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Previews and placeholder for an uploaded image"""
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    attachment = await db.attachments.find_one({"sha256": sha256}, {"_id": 0})
+    if not attachment:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    
+    attachment["url"] = f"/api/uploads/{attachment['name']}"
+    for derivative in attachment.get("derivatives", []):
+        derivative["url"] = f"/api/uploads/{derivative['name']}"
+    return Attachment(**attachment)
+
+# ===== GAME HUB =====
+# Games being played live in memory on this worker and that copy is the
+# authority: a move is validated and applied to it without touching the
+# database, broadcast to /ws/games/{game_id} at once, and persisted afterwards
+# in order as a $push of the move plus a $set of the handful of fields it
+# changed. Moves played on other workers arrive through the broker and are
+# folded into the live copy (apply_remote), so every worker's copy stays
+# current. A game is dropped from memory once its writes are flushed and
+# nobody is watching it.
+GAME_WRITE_BATCH_SIZE = int(os.environ.get('GAME_WRITE_BATCH_SIZE', '100'))
+
+def game_channel(game_id: str) -> str:
+    return f"game:{game_id}"
+
+class GameHub:
+    def __init__(self, collection):
+        self.collection = collection
+        self.games: Dict[str, dict] = {}
+        self.pending: Dict[str, int] = {}  # game_id -> moves queued but not yet written
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self.moves = 0
+        self.persisted = 0
+        self.conflicts = 0
+        self.failed = 0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write out every queued move, then stop"""
+        if self._task:
+            await self.queue.put(None)
+            await self._task
+
+    async def load(self, game_id: str) -> Optional[dict]:
+        game = self.games.get(game_id)
+        if game is None:
+            doc = await self.collection.find_one({"id": game_id}, {"_id": 0})
+            if doc is None:
+                return None
+            # Another request may have loaded it while we awaited; keep the first copy
+            game = self.games.setdefault(game_id, doc)
+        return game
+
+    async def play(self, game: dict, user_id: str, move: dict) -> dict:
+        """Apply a move to the live game, broadcast it and queue its write"""
+        if game.get("completed"):
+            raise game_engine.GameError("Game is over")
+        state = game["state"]
+        moves_before = len(state["history"])
+        # No await between validating and applying: moves on this worker are serialised
+        outcome = game_engine.play(game["game_type"], state, game["player_ids"], user_id, move)
+        game["completed"] = outcome["completed"]
+        game["result"] = {"winner": outcome["winner"]} if outcome["winner"] else None
+        game["updated_at"] = datetime.now(timezone.utc)
+
+        self.moves += 1
+        self.pending[game["id"]] = self.pending.get(game["id"], 0) + 1
+        # The write is encoded later, after more moves may have changed the live
+        # state in place, so it carries copies of everything mutable
+        self.queue.put_nowait((game["id"], UpdateOne(
+            # The history length guard catches a second worker playing the same game
+            {"id": game["id"], "state.history": {"$size": moves_before}},
+            {
+                "$push": {"state.history": dict(outcome["move"])},
+                "$set": {
+                    f"state.board.{outcome['move']['cell']}": outcome["move"]["symbol"],
+                    "state.turn": state["turn"],
+                    "state.bitboards": list(state["bitboards"]),
+                    "state.finished": state["finished"],
+                    "completed": game["completed"],
+                    "result": dict(game["result"]) if game["result"] else None,
+                    "updated_at": game["updated_at"],
+                },
+            }
+        )))
+        await manager.broadcast_event({
+            "type": "move",
+            "game_id": game["id"],
+            "move": outcome["move"],
+            "moves": len(state["history"]),
+            "board": state["board"],
+            "turn": state["turn"],
+            "bitboards": state["bitboards"],
+            "completed": game["completed"],
+            "result": game["result"],
+            "updated_at": game["updated_at"],
+        }, game_channel(game["id"]))
+        return outcome
+
+    def apply_remote(self, channel: str, message: str):
+        """Broker observer: fold a move played on another worker into our live copy"""
+        try:
+            event = json.loads(message)
+        except ValueError:
+            return
+        if not isinstance(event, dict) or event.get("type") != "move":
+            return
+        game = self.games.get(event.get("game_id"))
+        if game is None:
+            return
+        state = game["state"]
+        played = len(state["history"])
+        if played >= event["moves"]:
+            return  # played here, already applied
+        if played != event["moves"] - 1:
+            # We missed a move; reload from the database on next use
+            self.games.pop(game["id"], None)
+            return
+        move = event["move"]
+        state["history"].append(move)
+        state["board"][move["cell"]] = move["symbol"]
+        state["turn"] = event["turn"]
+        state["bitboards"] = event["bitboards"]
+        state["finished"] = event["completed"]
+        game["completed"] = event["completed"]
+        game["result"] = event["result"]
+        game["updated_at"] = datetime.fromisoformat(event["updated_at"])
+
+    def release(self, game_id: str):
+        """Forget a game nobody on this worker is playing or watching"""
+        if not self.pending.get(game_id) and not manager.active_connections.get(game_channel(game_id)):
+            self.games.pop(game_id, None)
+            self.pending.pop(game_id, None)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= GAME_WRITE_BATCH_SIZE or self.queue.empty():
+                    break
+                item = self.queue.get_nowait()
+            stopping = item is None
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch: List[tuple]):
+        try:
+            # Ordered, so each game's moves land in the order they were played
+            result = await self.collection.bulk_write([op for _, op in batch], ordered=True)
+            self.persisted += result.modified_count
+            conflicts = len(batch) - result.matched_count
+        except Exception as e:
+            logger.error(f"Game move batch of {len(batch)} failed: {e}")
+            self.failed += len(batch)
+            conflicts = len(batch)
+        game_ids = {game_id for game_id, _ in batch}
+        if conflicts:
+            # Some game moved elsewhere: reload every game in the batch from the
+            # database next time and have watchers fetch the stored state
+            self.conflicts += conflicts
+            for game_id in game_ids:
+                self.games.pop(game_id, None)
+                await manager.broadcast_event({"type": "resync", "game_id": game_id}, game_channel(game_id))
+        for game_id, _ in batch:
+            self.pending[game_id] -= 1
+        for game_id in game_ids:
+            self.release(game_id)
+
+    def stats(self) -> dict:
+        return {
+            "live_games": len(self.games),
+            "queue_depth": self.queue.qsize(),
+            "moves": self.moves,
+            "persisted": self.persisted,
+            "conflicts": self.conflicts,
+            "failed": self.failed,
+        }
 
+game_hub = GameHub(db.games)
 
 # ===== MINI-GAMES API BELOW! =====
 
 @api_router.post("/servers/{server_id}/games", response_model=GameSession)
 async def create_game(
     server_id: str,
-    game_type: str,
-    player_ids: List[str],
+    request: CreateGameRequest,
     authorization: Optional[str] = Header(None),
     session_token: Optional[str] = Cookie(None)
 ):
     user = await get_current_user(authorization, session_token)
-    if not user or user.id not in player_ids:
+    if not user or user.id not in request.player_ids:
         raise HTTPException(status_code=401, detail="Not authorized")
-    # initial state for Tic Tac Toe
-    state = {"board": [None] * 9, "turn": player_ids[0], "history": []}
+    await require_server_member(server_id, user)
+    for player_id in request.player_ids:
+        if not await is_server_member(server_id, player_id):
+            raise HTTPException(status_code=400, detail="All players must be server members")
+    try:
+        state = game_engine.new_state(request.game_type, request.player_ids)
+    except game_engine.GameError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     game = GameSession(
         id=str(uuid.uuid4()),
         server_id=server_id,
         channel_id=None,
-        game_type=game_type,
-        player_ids=player_ids,
+        game_type=request.game_type,
+        player_ids=request.player_ids,
         state=state,
         created_at=datetime.now(timezone.utc),
         updated_at=datetime.now(timezone.utc),
@@ -838,9 +3023,14 @@ async def create_game(
     return game
 
 @api_router.get("/servers/{server_id}/games")
-async def list_games(server_id: str):
-    games = await db.games.find({"server_id": server_id}).sort("updated_at", -1).to_list(100)
-    return games
+async def list_games(server_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    user = await get_current_user(authorization, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    await require_server_member(server_id, user)
+    games = await db.games.find({"server_id": server_id}, {"_id": 0}).sort("updated_at", -1).to_list(100)
+    # Moves still queued for writing are already applied to the live copies
+    return [game_hub.games.get(g["id"], g) for g in games]
 
 @api_router.post("/games/{game_id}/move")
 async def make_move(
@@ -849,34 +3039,38 @@ async def make_move(
     authorization: Optional[str] = Header(None),
     session_token: Optional[str] = Cookie(None)
 ):
+    """Play a move; applied to the live game and broadcast before it is written"""
     user = await get_current_user(authorization, session_token)
-    game = await db.games.find_one({"id": game_id})
-    if not game or user.id not in game["player_ids"]: raise HTTPException(status_code=403)
-    board = game["state"]["board"]
-    idx = move["cell"]
-    symbol = "X" if user.id == game["player_ids"][0] else "O"
-    if board[idx] is not None:
-        raise HTTPException(400, "Cell not empty")
-    board[idx] = symbol
-    game["state"]["history"].append({"player": user.id, "cell": idx, "symbol": symbol})
-    # Win logic
-    win_patterns = [
-        [0,1,2], [3,4,5],[6,7,8],[0,3,6],[1,4,7],[2,5,8],[0,4,8],[2,4,6]
-    ]
-    winner = None
-    for pat in win_patterns:
-        s = {board[i] for i in pat}
-        if len(s) == 1 and list(s)[0]: winner = user.id
-    completed = bool(winner) or all(cell is not None for cell in board)
-    result = {"winner": winner} if winner else None
-    await db.games.update_one(
-        {"id": game_id},
-        {"$set": {"state": game["state"], "completed": completed, "result": result, "updated_at": datetime.now(timezone.utc)}}
-    )
-    return {"success": True, "winner": winner}
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    game = await game_hub.load(game_id)
+    try:
+        if not game or user.id not in game["player_ids"]:
+            raise HTTPException(status_code=403, detail="Not authorized")
+        outcome = await game_hub.play(game, user.id, move)
+    except game_engine.GameError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        game_hub.release(game_id)
+    return {"success": True, "winner": outcome["winner"], "completed": outcome["completed"], "turn": outcome["turn"], "move": outcome["move"]}
+
 
 
 
+# ===== METRICS =====
+@api_router.get("/metrics")
+async def get_metrics():
+    """In-process counters for this worker"""
+    return {
+        "session_cache": session_cache.stats(),
+        "membership_cache": membership_cache.stats(),
+        "voice_rosters": voice_rosters.stats(),
+        "agenda_cache": agenda_cache.stats(),
+        "websockets": manager.stats(),
+        "games": game_hub.stats(),
+        "note_sessions": len(note_sessions),
+        "message_writes": message_writer.stats() if message_writer else {"mode": "sync"},
+    }
 
 # ===== VOICE/VIDEO CHANNEL ROUTES =====
 @api_router.post("/channels/{channel_id}/join")
@@ -901,7 +3095,16 @@ async def join_voice_channel(channel_id: str, authorization: Optional[str] = Hea
         user_id=user.id,
         joined_at=datetime.now(timezone.utc)
     )
-    await db.voice_participants.insert_one(participant.dict())
+    try:
+        await db.voice_participants.insert_one(participant.dict())
+    except DuplicateKeyError:
+        # A concurrent join won the (channel_id, user_id) unique index
+        existing = await db.voice_participants.find_one({"channel_id": channel_id, "user_id": user.id})
+        return VoiceChannelParticipant(**existing)
+    
+    roster = voice_roster_changed(channel_id)
+    if roster is not None:
+        roster[user.id] = {**participant.dict(), "user": user.dict()}
     return participant
 
 @api_router.post("/channels/{channel_id}/leave")
@@ -915,8 +3118,32 @@ async def leave_voice_channel(channel_id: str, authorization: Optional[str] = He
         "channel_id": channel_id,
         "user_id": user.id
     })
+    roster = voice_roster_changed(channel_id)
+    if roster is not None:
+        roster.pop(user.id, None)
     return {"success": True}
 
+async def load_voice_roster(channel_id: str) -> dict:
+    """Read a channel's participants and hydrate their users in two queries"""
+    participants = await db.voice_participants.find({"channel_id": channel_id}, {"_id": 0}).to_list(None)
+    user_ids = [p["user_id"] for p in participants]
+    users = await db.users.find({"id": {"$in": user_ids}}, {"_id": 0}).to_list(None) if user_ids else []
+    users_by_id = {u["id"]: User(**u).dict() for u in users}
+    return {
+        p["user_id"]: {**p, "user": users_by_id[p["user_id"]]}
+        for p in participants if p["user_id"] in users_by_id
+    }
+
+def voice_roster_changed(channel_id: str) -> Optional[dict]:
+    """Record a participant write for the channel; returns its cached roster to edit, if any"""
+    voice_roster_generations[channel_id] = voice_roster_generations.get(channel_id, 0) + 1
+    return voice_rosters.get(channel_id)
+
+def update_voice_roster(channel_id: str, user_id: str, **fields):
+    roster = voice_roster_changed(channel_id)
+    if roster is not None and user_id in roster:
+        roster[user_id].update(fields)
+
 @api_router.get("/channels/{channel_id}/participants")
 async def get_voice_participants(channel_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
     """Get all participants in a voice/video channel"""
@@ -924,24 +3151,14 @@ async def get_voice_participants(channel_id: str, authorization: Optional[str] =
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    participants = await db.voice_participants.find({"channel_id": channel_id}).to_list(1000)
-    
-    # Get user details for each participant
-    result = []
-    for p in participants:
-        user_doc = await db.users.find_one({"id": p["user_id"]})
-        if user_doc:
-            # Remove MongoDB _id field from participant data
-            participant_data = {k: v for k, v in p.items() if k != "_id"}
-            # Remove MongoDB _id field from user data
-            user_data = {k: v for k, v in user_doc.items() if k != "_id"}
-            
-            result.append({
-                **participant_data,
-                "user": User(**user_data).dict()
-            })
-    
-    return result
+    roster = voice_rosters.get(channel_id)
+    if roster is None:
+        generation = voice_roster_generations.get(channel_id, 0)
+        roster = await load_voice_roster(channel_id)
+        # A join, leave or toggle during the load found nothing cached to edit
+        if voice_roster_generations.get(channel_id, 0) == generation:
+            voice_rosters.set(channel_id, roster)
+    return list(roster.values())
 
 @api_router.post("/channels/{channel_id}/toggle-mute")
 async def toggle_mute(channel_id: str, is_muted: bool, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
@@ -954,6 +3171,7 @@ async def toggle_mute(channel_id: str, is_muted: bool, authorization: Optional[s
         {"channel_id": channel_id, "user_id": user.id},
         {"$set": {"is_muted": is_muted}}
     )
+    update_voice_roster(channel_id, user.id, is_muted=is_muted)
     return {"success": True}
 
 @api_router.post("/channels/{channel_id}/toggle-video")
@@ -967,59 +3185,293 @@ async def toggle_video(channel_id: str, is_video_enabled: bool, authorization: O
         {"channel_id": channel_id, "user_id": user.id},
         {"$set": {"is_video_enabled": is_video_enabled}}
     )
+    update_voice_roster(channel_id, user.id, is_video_enabled=is_video_enabled)
     return {"success": True}
 
 # ===== WEBSOCKET FOR REAL-TIME =====
-class ConnectionManager:
+WS_SEND_QUEUE_SIZE = int(os.environ.get('WS_SEND_QUEUE_SIZE', '256'))
+WS_SEND_TIMEOUT = float(os.environ.get('WS_SEND_TIMEOUT', '10'))
+# What to do when a client's queue is full: drop_oldest, drop_newest or disconnect
+WS_SLOW_CONSUMER_POLICY = os.environ.get('WS_SLOW_CONSUMER_POLICY', 'drop_oldest')
+
+class ClientConnection:
+    """An accepted WebSocket with its own bounded outbound queue and writer task.
+
+    Producers only ever enqueue, so a slow or dead client never blocks a
+    broadcast to anyone else.
+    """
+
+    def __init__(self, websocket: WebSocket, on_closed):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.closed = False
+        self.failed = False  # closed by us rather than by the client
+        self.dropped = 0
+        self._on_closed = on_closed
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message: str) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            pass
+        self.dropped += 1
+        if WS_SLOW_CONSUMER_POLICY == "disconnect":
+            self.failed = True
+            self.close(code=1013)  # Try again later
+            return False
+        if WS_SLOW_CONSUMER_POLICY == "drop_oldest":
+            self.queue.get_nowait()
+            self.queue.put_nowait(message)
+            return True
+        return False
+
+    async def _write_loop(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(message), WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Send failed or timed out: the socket is dead to us
+            self.failed = True
+            self.close(code=1011)
+
+    def close(self, code: Optional[int] = None):
+        if self.closed:
+            return
+        self.closed = True
+        self._writer.cancel()
+        self._on_closed(self)
+        if code is not None:
+            asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+class Broker(ABC):
+    """Carries channel broadcasts and signaling messages to every worker.
+
+    Each worker hands its broker a delivery callback; publish() must end up
+    calling it on every worker (including this one) exactly once.
+    """
+
     def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}  # channel_id -> list of websockets
-        self.user_connections: Dict[str, WebSocket] = {}  # user_id -> websocket for signaling
-    
-    async def connect(self, websocket: WebSocket, channel_id: str):
+        self._deliver = None
+
+    def set_handler(self, deliver):
+        self._deliver = deliver
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, kind: str, target: str, message: str):
+        """Deliver a message to every worker's handler, this one included"""
+
+class InMemoryBroker(Broker):
+    """Single-process deployments: publishing is local delivery"""
+
+    async def publish(self, kind: str, target: str, message: str):
+        self._deliver(kind, target, message)
+
+class MongoChangeStreamBroker(Broker):
+    """Multi-worker fan-out through an insert-only collection and a change stream.
+
+    Local subscribers are served straight away; the change stream only brings
+    in events published by other workers. Change streams need a replica set.
+    """
+
+    def __init__(self, collection):
+        super().__init__()
+        self.collection = collection
+        self.worker_id = str(uuid.uuid4())
+        self._task: Optional[asyncio.Task] = None
+        self._resume_token = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def publish(self, kind: str, target: str, message: str):
+        self._deliver(kind, target, message)
+        await self.collection.insert_one({
+            "origin": self.worker_id,
+            "kind": kind,
+            "target": target,
+            "message": message,
+            "created_at": datetime.now(timezone.utc),
+        })
+
+    async def _watch(self):
+        pipeline = [{"$match": {"operationType": "insert", "fullDocument.origin": {"$ne": self.worker_id}}}]
+        while True:
+            try:
+                async with self.collection.watch(pipeline, resume_after=self._resume_token) as stream:
+                    # Open from here on: a failure before the first event must
+                    # resume at this point, not at whenever the retry opens
+                    self._resume_token = stream.resume_token
+                    async for change in stream:
+                        self._resume_token = stream.resume_token
+                        event = change["fullDocument"]
+                        self._deliver(event["kind"], event["target"], event["message"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Broker change stream failed, retrying: {e}")
+                await asyncio.sleep(1)
+
+def make_broker() -> Broker:
+    # WS_BROKER=memory for a single worker, mongo when running several
+    kind = os.environ.get('WS_BROKER', 'memory')
+    if kind == "mongo":
+        return MongoChangeStreamBroker(db.ws_events)
+    if kind != "memory":
+        raise RuntimeError(f"Unknown WS_BROKER: {kind}")
+    return InMemoryBroker()
+
+class ConnectionManager:
+    def __init__(self, broker: Broker):
+        self.broker = broker
+        broker.set_handler(self.deliver_local)
+        self.observers: List[tuple] = []  # (channel prefix, callback) for server-side consumers
+        self.active_connections: Dict[str, Dict[WebSocket, ClientConnection]] = {}  # channel_id -> websocket -> connection
+        self.user_connections: Dict[str, ClientConnection] = {}  # user_id -> connection for signaling
+        self.pruned = 0
+        self.dropped = 0
+    
+    async def connect(self, websocket: WebSocket, channel_id: str) -> ClientConnection:
         await websocket.accept()
-        if channel_id not in self.active_connections:
-            self.active_connections[channel_id] = []
-        self.active_connections[channel_id].append(websocket)
+        connection = ClientConnection(websocket, lambda conn: self._forget(conn, channel_id))
+        self.active_connections.setdefault(channel_id, {})[websocket] = connection
+        return connection
     
     def disconnect(self, websocket: WebSocket, channel_id: str):
-        if channel_id in self.active_connections:
-            if websocket in self.active_connections[channel_id]:
-                self.active_connections[channel_id].remove(websocket)
+        connection = self.active_connections.get(channel_id, {}).get(websocket)
+        if connection:
+            connection.close()
+    
+    def _forget(self, connection: ClientConnection, channel_id: str):
+        self._retire(connection)
+        connections = self.active_connections.get(channel_id)
+        if connections and connections.get(connection.websocket) is connection:
+            del connections[connection.websocket]
+            if not connections:
+                del self.active_connections[channel_id]
+    
+    def _retire(self, connection: ClientConnection):
+        self.dropped += connection.dropped
+        if connection.failed:
+            self.pruned += 1
     
     async def broadcast(self, message: str, channel_id: str):
-        if channel_id in self.active_connections:
-            for connection in self.active_connections[channel_id]:
-                try:
-                    await connection.send_text(message)
-                except:
-                    pass
-    
-    async def connect_signaling(self, websocket: WebSocket, user_id: str):
+        await self.broker.publish("channel", channel_id, message)
+    
+    def observe(self, prefix: str, callback):
+        """Also hand every channel message under `prefix` to callback(channel, message)"""
+        self.observers.append((prefix, callback))
+    
+    def deliver_local(self, kind: str, target: str, message: str):
+        """Broker callback: hand a published message to this worker's sockets"""
+        if kind == "channel":
+            for prefix, callback in self.observers:
+                if target.startswith(prefix):
+                    callback(target, message)
+            for connection in list(self.active_connections.get(target, {}).values()):
+                connection.enqueue(message)
+        elif kind == "user":
+            connection = self.user_connections.get(target)
+            if connection:
+                connection.enqueue(message)
+    
+    async def broadcast_event(self, event: dict, channel_id: str):
+        """Serialise once and fan the same payload out to every subscriber"""
+        await self.broadcast(json.dumps(jsonable_encoder(event)), channel_id)
+    
+    async def connect_signaling(self, websocket: WebSocket, user_id: str) -> ClientConnection:
         await websocket.accept()
-        self.user_connections[user_id] = websocket
-    
-    def disconnect_signaling(self, user_id: str):
-        if user_id in self.user_connections:
+        previous = self.user_connections.get(user_id)
+        connection = ClientConnection(websocket, lambda conn: self._forget_signaling(conn, user_id))
+        self.user_connections[user_id] = connection
+        if previous:
+            previous.close(code=1000)
+        return connection
+    
+    def disconnect_signaling(self, user_id: str, websocket: Optional[WebSocket] = None):
+        connection = self.user_connections.get(user_id)
+        if connection and (websocket is None or connection.websocket is websocket):
+            connection.close()
+    
+    def _forget_signaling(self, connection: ClientConnection, user_id: str):
+        self._retire(connection)
+        if self.user_connections.get(user_id) is connection:
             del self.user_connections[user_id]
     
     async def send_to_user(self, user_id: str, message: str):
-        if user_id in self.user_connections:
-            try:
-                await self.user_connections[user_id].send_text(message)
-            except:
-                pass
+        connection = self.user_connections.get(user_id)
+        if connection:
+            connection.enqueue(message)
+        else:
+            # The peer may be connected to another worker
+            await self.broker.publish("user", user_id, message)
+    
+    def stats(self) -> dict:
+        live = [c for conns in self.active_connections.values() for c in conns.values()]
+        live.extend(self.user_connections.values())
+        return {
+            "channels": len(self.active_connections),
+            "channel_connections": sum(len(c) for c in self.active_connections.values()),
+            "signaling_connections": len(self.user_connections),
+            "queued": sum(c.queue.qsize() for c in live),
+            "dropped": self.dropped + sum(c.dropped for c in live),
+            "pruned": self.pruned,
+            "slow_consumer_policy": WS_SLOW_CONSUMER_POLICY,
+        }
 
-manager = ConnectionManager()
+manager = ConnectionManager(make_broker())
+# Moves played on other workers keep this worker's live games current
+manager.observe("game:", game_hub.apply_remote)
+manager.observe("note:", note_channel_event)
+
+# Manager channels owned by authenticated endpoints; their frames are
+# server-authored, so the open relay below must never subscribe or publish to them
+RESERVED_CHANNEL_PREFIXES = ("note:", "game:")
 
 @app.websocket("/ws/{channel_id}")
 async def websocket_endpoint(websocket: WebSocket, channel_id: str):
+    if channel_id.startswith(RESERVED_CHANNEL_PREFIXES):
+        await websocket.close(code=1008)
+        return
     await manager.connect(websocket, channel_id)
     try:
         while True:
             data = await websocket.receive_text()
+            # Persisted events are published by the REST handlers; clients may
+            # only relay their own ephemeral events (typing indicators etc.)
+            try:
+                event_type = json.loads(data).get("type")
+            except (ValueError, AttributeError):
+                event_type = None
+            if event_type in SERVER_EVENT_TYPES:
+                continue
             # Broadcast message to all connected clients
             await manager.broadcast(data, channel_id)
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket, channel_id)
 
 @app.websocket("/ws/signaling/{user_id}")
@@ -1037,7 +3489,103 @@ async def signaling_endpoint(websocket: WebSocket, user_id: str):
                 if target_user_id:
                     await manager.send_to_user(target_user_id, data)
     except WebSocketDisconnect:
-        manager.disconnect_signaling(user_id)
+        pass
+    finally:
+        manager.disconnect_signaling(user_id, websocket)
+
+@app.websocket("/ws/games/{game_id}")
+async def game_endpoint(websocket: WebSocket, game_id: str):
+    """Live game: server members may watch, players send {"type": "move", ...}.
+
+    A state message is sent on connect; every accepted move (from here or
+    from the REST route) is pushed to all watchers as a "move" event.
+    """
+    user = await get_current_user(session_token=websocket.cookies.get("session_token") or websocket.query_params.get("token"))
+    game = await game_hub.load(game_id) if user else None
+    if not game or not await is_server_member(game["server_id"], user.id):
+        await websocket.close(code=1008)
+        if game:
+            game_hub.release(game_id)
+        return
+
+    channel = game_channel(game_id)
+    connection = await manager.connect(websocket, channel)
+    connection.enqueue(json.dumps(jsonable_encoder({"type": "state", "game": game})))
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                kind = message.pop("type", None)
+            except (ValueError, AttributeError):
+                continue
+            if kind != "move":
+                continue
+            # Reload in case the live copy was dropped after a write conflict
+            game = await game_hub.load(game_id)
+            if game is None:
+                break
+            try:
+                await game_hub.play(game, user.id, message)
+            except game_engine.GameError as e:
+                connection.enqueue(json.dumps({"type": "error", "detail": str(e)}))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.disconnect(websocket, channel)
+        game_hub.release(game_id)
+
+@app.websocket("/ws/notes/{note_id}")
+async def note_editing_endpoint(websocket: WebSocket, note_id: str):
+    """Collaborative editing: clients send {"type": "op", "revision", "op"} deltas.
+
+    The server answers with an init message (content and revision), then
+    relays every accepted op in revision order; an op carrying the sender's
+    own client_id is its ack. "cursor" messages are relayed to the others.
+    """
+    user = await get_current_user(session_token=websocket.cookies.get("session_token") or websocket.query_params.get("token"))
+    session = await open_note_session(note_id) if user else None
+    if not session or not session.collaborative or not await is_server_member(session.server_id, user.id):
+        await websocket.close(code=1008)
+        if session:
+            await release_note_session(note_id)
+        return
+
+    channel = note_channel(note_id)
+    client_id = str(uuid.uuid4())
+    connection = await manager.connect(websocket, channel)
+    # Re-fetch: the session may have been released while we were accepting
+    session = await open_note_session(note_id) or session
+    connection.enqueue(json.dumps({"type": "init", "client_id": client_id, "revision": session.revision, "content": session.content}))
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                kind = message.get("type")
+            except (ValueError, AttributeError):
+                continue
+            if kind == "cursor":
+                await manager.broadcast(json.dumps({**message, "client_id": client_id, "user_id": user.id}), channel)
+            elif kind == "op":
+                try:
+                    op = note_ot.validate(message.get("op"))
+                    revision, applied = await session.submit(op, int(message.get("revision")), user.id)
+                except NoteResync:
+                    connection.enqueue(json.dumps({"type": "resync", "revision": session.revision, "content": session.content}))
+                    continue
+                except NoteDeleted:
+                    connection.enqueue(json.dumps({"type": "deleted"}))
+                    continue
+                except (TypeError, ValueError) as e:
+                    connection.enqueue(json.dumps({"type": "error", "detail": str(e)}))
+                    continue
+                await publish_note_op(note_id, revision, applied, user.id, client_id)
+                if revision - session.snapshot_revision >= NOTE_SNAPSHOT_INTERVAL:
+                    await session.snapshot()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.disconnect(websocket, channel)
+        await release_note_session(note_id)
 
 # ===== INCLUDE ROUTER =====
 app.include_router(api_router)
@@ -1048,6 +3596,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor", "ETag"],
 )
 
 logging.basicConfig(
@@ -1056,6 +3605,152 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ===== INDEXES =====
+# (collection, keys, options). Every query the routes issue should be served
+# by one of these; VERIFY_QUERY_SHAPES below checks that with explain().
+INDEX_SPECS = [
+    ("user_sessions", [("session_token", ASCENDING)], {"unique": True}),
+    ("user_sessions", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ("users", [("id", ASCENDING)], {"unique": True}),
+    ("users", [("email", ASCENDING)], {"unique": True}),
+    ("servers", [("id", ASCENDING)], {"unique": True}),
+    ("servers", [("members", ASCENDING)], {}),
+    ("channels", [("id", ASCENDING)], {"unique": True}),
+    ("channels", [("server_id", ASCENDING)], {}),
+    ("messages", [("id", ASCENDING)], {"unique": True}),
+    ("messages", [("channel_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+    ("messages", [("channel_id", ASCENDING), ("parent_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], {}),
+    ("messages", [("content", TEXT)], {"name": "messages_content_text"}),
+    ("calendar_events", [("id", ASCENDING)], {"unique": True}),
+    ("calendar_events", [("server_id", ASCENDING), ("start_time", ASCENDING), ("end_time", ASCENDING)], {}),
+    ("calendar_events", [("assigned_to", ASCENDING), ("start_time", ASCENDING)], {}),
+    ("tasks", [("id", ASCENDING)], {"unique": True}),
+    ("tasks", [("server_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+    ("tasks", [("assigned_to", ASCENDING), ("deadline", ASCENDING)], {}),
+    ("notes", [("id", ASCENDING)], {"unique": True}),
+    ("notes", [("server_id", ASCENDING), ("updated_at", DESCENDING)], {}),
+    ("note_ops", [("note_id", ASCENDING), ("revision", ASCENDING)], {"unique": True}),
+    ("voice_participants", [("channel_id", ASCENDING), ("user_id", ASCENDING)], {"unique": True}),
+    ("upload_sessions", [("id", ASCENDING)], {"unique": True}),
+    ("attachments", [("sha256", ASCENDING)], {"unique": True}),
+    ("upload_sessions", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ("games", [("id", ASCENDING)], {"unique": True}),
+    ("games", [("server_id", ASCENDING), ("updated_at", DESCENDING)], {}),
+    ("ws_events", [("created_at", ASCENDING)], {"expireAfterSeconds": 300}),
+]
+
+# (route, collection, filter, sort) with placeholder values, mirroring the
+# shape of the queries issued by the handlers above.
+VERIFY_QUERY_SHAPES = [
+    ("get_current_user", "user_sessions", {"session_token": "x", "expires_at": {"$gt": datetime(1970, 1, 1)}}, None),
+    ("get_current_user", "users", {"id": "x"}, None),
+    ("process_session", "users", {"email": "x"}, None),
+    ("get_servers", "servers", {"members": "x"}, None),
+    ("get_server", "servers", {"id": "x"}, None),
+    ("require_server_member", "servers", {"id": "x", "members": "x"}, None),
+    ("get_server_snapshot", "voice_participants", {"channel_id": "x"}, None),
+    ("get_server_members", "users", {"id": {"$in": ["x", "y"]}}, None),
+    ("get_channels", "channels", {"server_id": "x"}, None),
+    ("get_messages", "messages", {"channel_id": "x"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("get_messages", "messages", {"channel_id": "x", **keyset_filter("created_at", encode_cursor(datetime(1970, 1, 1), "x"), True)}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("get_threads", "messages", {"channel_id": "x", "parent_id": {"$ne": None}}, None),
+    ("get_thread_replies", "messages", {"channel_id": "x", "parent_id": "x"}, [("created_at", ASCENDING), ("id", ASCENDING)]),
+    ("add_reaction", "messages", {"id": "x"}, None),
+    ("search_messages", "messages", {"$text": {"$search": "x"}, "channel_id": "x"}, None),
+    ("get_events", "calendar_events", {"server_id": "x"}, [("start_time", ASCENDING)]),
+    ("get_events", "calendar_events", overlap_query("x", datetime(1970, 1, 1), datetime(1970, 1, 2)), None),
+    ("get_event", "calendar_events", {"id": "x", "server_id": "x"}, None),
+    ("get_agenda", "calendar_events", {"assigned_to": "x", "server_id": {"$in": ["x"]}, "recurrence": None, "start_time": {"$lt": datetime(1970, 1, 2)}, "end_time": {"$gt": datetime(1970, 1, 1)}}, [("start_time", ASCENDING)]),
+    ("get_agenda", "tasks", {"assigned_to": "x", "server_id": {"$in": ["x"]}, "deadline": {"$gte": datetime(1970, 1, 1), "$lt": datetime(1970, 1, 2)}, "completed": False}, [("deadline", ASCENDING)]),
+    ("get_tasks", "tasks", {"server_id": "x"}, [("created_at", DESCENDING)]),
+    ("get_task", "tasks", {"id": "x", "server_id": "x"}, None),
+    ("get_notes", "notes", {"server_id": "x"}, [("updated_at", DESCENDING)]),
+    ("get_note", "notes", {"id": "x", "server_id": "x"}, None),
+    ("get_note", "note_ops", {"note_id": "x", "revision": {"$gt": 0}}, [("revision", ASCENDING)]),
+    ("get_voice_participants", "voice_participants", {"channel_id": "x"}, None),
+    ("join_voice_channel", "voice_participants", {"channel_id": "x", "user_id": "x"}, None),
+    ("list_games", "games", {"server_id": "x"}, [("updated_at", DESCENDING)]),
+    ("get_attachment", "attachments", {"sha256": "x"}, None),
+    ("make_move", "games", {"id": "x"}, None),
+]
+
+async def ensure_indexes() -> List[str]:
+    """Create every index in INDEX_SPECS; safe to run on every start"""
+    created = []
+    for collection, keys, options in INDEX_SPECS:
+        try:
+            name = await db[collection].create_index(keys, **options)
+            created.append(f"{collection}.{name}")
+        except OperationFailure as e:
+            # Conflicting options or duplicate data; leave it for an operator
+            logger.error(f"Index {collection} {keys} not created: {e}")
+    return created
+
+def _plan_stages(plan) -> List[str]:
+    """Collect every stage name in an explain() plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+async def verify_indexes() -> List[dict]:
+    """Explain each route's query shape and flag the ones that scan a collection"""
+    report = []
+    for route, collection, query, sort in VERIFY_QUERY_SHAPES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        entry = {"route": route, "collection": collection, "stages": stages, "collscan": "COLLSCAN" in stages}
+        if entry["collscan"]:
+            logger.warning(f"COLLSCAN: {route} on {collection} {query}")
+        report.append(entry)
+    return report
+
+@app.on_event("startup")
+async def bootstrap_indexes():
+    if os.environ.get('ENSURE_INDEXES', '1') == '1':
+        await ensure_indexes()
+    if os.environ.get('VERIFY_INDEXES', '0') == '1':
+        await verify_indexes()
+
+@app.on_event("startup")
+async def start_background_workers():
+    await manager.broker.start()
+    await game_hub.start()
+    if message_writer:
+        await message_writer.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await manager.broker.stop()
+    await game_hub.stop()
+    if message_writer:
+        await message_writer.stop()
+    if derivative_pool:
+        derivative_pool.shutdown(wait=False, cancel_futures=True)
     client.close()
+
+if __name__ == "__main__":
+    # python server.py [--verify]  -- run the index migration out of band
+    import asyncio
+    import sys
+
+    async def _migrate():
+        for name in await ensure_indexes():
+            print(f"ok  {name}")
+        if "--verify" in sys.argv:
+            collscans = [r for r in await verify_indexes() if r["collscan"]]
+            for r in collscans:
+                print(f"COLLSCAN  {r['route']} ({r['collection']})")
+            return 1 if collscans else 0
+        return 0
+
+    sys.exit(asyncio.run(_migrate()))
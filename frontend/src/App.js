@@ -541,8 +541,10 @@ const Dashboard = ({ user, onLogout }) => {
 
     ws.onmessage = (event) => {
       const data = JSON.parse(event.data);
-      if (data.type === "new_message") {
-        setMessages(prev => [...prev, data.message]);
+      if (data.type === "new_message" || data.type === "thread_reply") {
+        setMessages(prev => prev.some(m => m.id === data.message.id) ? prev : [...prev, data.message]);
+      } else if (data.type === "message_edited") {
+        setMessages(prev => prev.map(m => m.id === data.message.id ? data.message : m));
       }
     };
 
@@ -607,13 +609,9 @@ const Dashboard = ({ user, onLogout }) => {
     setStarModeEnabled(false);
     setMessageInput('');
 
-    // Broadcast via WebSocket
-    if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
-      wsRef.current.send(JSON.stringify({
-        type: "new_message",
-        message: response.data
-      }));
-    }
+    // The server pushes the new message to the channel socket; add it here
+    // too in case our own socket is not connected
+    setMessages(prev => prev.some(m => m.id === response.data.id) ? prev : [...prev, response.data]);
 
     // Optional: clear message input again for extra safety
     setMessageInput('');
@@ -849,6 +847,31 @@ const Dashboard = ({ user, onLogout }) => {
       setGames(resp.data);
     };
     useEffect(() => { loadGames(); }, [selectedServer]);
+
+    // Live moves for the game on screen, ours and the opponent's
+    const activeGameId = activeGame?.id;
+    useEffect(() => {
+      if (!activeGameId) return;
+      const ws = new WebSocket(`${WS_URL}/ws/games/${activeGameId}`);
+      ws.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.type === 'state') {
+          setActiveGame(data.game);
+        } else if (data.type === 'move') {
+          setActiveGame(g => g && g.id === data.game_id
+            ? { ...g, state: { ...g.state, board: data.board, turn: data.turn }, completed: data.completed, result: data.result }
+            : g);
+          if (data.completed) loadGames();
+        } else if (data.type === 'resync') {
+          axios.get(`${API}/servers/${selectedServer.id}/games`, {withCredentials:true}).then(resp => {
+            setGames(resp.data);
+            const found = resp.data.find(g => g.id === data.game_id);
+            if (found) setActiveGame(found);
+          });
+        }
+      };
+      return () => ws.close();
+    }, [activeGameId]);
     
     // Start a new Tic Tac Toe game
     const startTicTacToe = async () => {
@@ -875,10 +898,7 @@ const Dashboard = ({ user, onLogout }) => {
     const makeTicTacToeMove = async (cellIdx) => {
       if (!activeGame) return;
       const resp = await axios.post(`${API}/games/${activeGame.id}/move`, {cell: cellIdx}, {withCredentials:true});
-      // Refetch updated game state
-      const updated = await axios.get(`${API}/servers/${selectedServer.id}/games`, {withCredentials:true});
-      const found = updated.data.find(g => g.id === activeGame.id);
-      setActiveGame(found);
+      // The game socket delivers the new board to both players
       if (resp.data.winner) {
         alert(`Game Over! Winner: ${resp.data.winner === user.id ? "You" : "Opponent"}`);
         loadGames();
@@ -1209,7 +1229,9 @@ const Dashboard = ({ user, onLogout }) => {
                                 body: formData,
                                 credentials: 'include'
                               });
-                              const { url } = await res.json();
+                              const { url: path } = await res.json();
+                              // Uploads are served by the backend, which may live on another origin
+                              const url = path.startsWith('/api/') ? `${BACKEND_URL}${path}` : path;
                               // Insert markdown for images and files
                               const fileLine = url.match(/\.(jpg|jpeg|png|gif|bmp|webp)$/i)
                                 ? `![](${url})`
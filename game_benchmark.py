@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+AstralLink Game Engine Benchmark
+Times move evaluation in backend/game_engine.py against the list-and-set win
+check make_move used before the engine existed. Pure CPU, no database needed.
+"""
+
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import game_engine  # noqa: E402
+
+# Configuration
+POSITIONS = 2_000
+REPEATS = 5
+PLAYERS = ["player-x", "player-o"]
+
+def legacy_win_check(board, symbol):
+    """The previous make_move logic, rebuilt on every call as it was"""
+    win_patterns = [
+        [0, 1, 2], [3, 4, 5], [6, 7, 8], [0, 3, 6], [1, 4, 7], [2, 5, 8], [0, 4, 8], [2, 4, 6]
+    ]
+    winner = None
+    for pat in win_patterns:
+        s = {board[i] for i in pat}
+        if len(s) == 1 and list(s)[0]:
+            winner = symbol
+    return winner
+
+def random_positions(count):
+    """(board, bitboard, last cell, symbol) for positions reached by random play"""
+    engine = game_engine.get_game_type("tictactoe")
+    positions = []
+    while len(positions) < count:
+        state = engine.new_state(PLAYERS)
+        while not state.get("finished"):
+            outcome = engine.play(state, PLAYERS, state["turn"], {"cell": random.choice([i for i, c in enumerate(state["board"]) if c is None])})
+            player = PLAYERS.index(outcome["move"]["player"])
+            positions.append((list(state["board"]), state["bitboards"][player], outcome["move"]["cell"], outcome["move"]["symbol"]))
+    return positions[:count]
+
+def connect_four_positions(count):
+    engine = game_engine.get_game_type("connect4")
+    positions = []
+    while len(positions) < count:
+        state = engine.new_state(PLAYERS)
+        while not state.get("finished"):
+            try:
+                engine.play(state, PLAYERS, state["turn"], {"column": random.randrange(engine.WIDTH)})
+            except game_engine.GameError:
+                continue
+            positions.append(state["bitboards"][len(state["history"]) % 2 ^ 1])
+    return positions[:count]
+
+def per_call_ns(run, calls):
+    return min(timeit.repeat(run, number=1, repeat=REPEATS)) / calls * 1e9
+
+def main():
+    random.seed(7)
+    ttt = game_engine.get_game_type("tictactoe")
+    c4 = game_engine.get_game_type("connect4")
+    positions = random_positions(POSITIONS)
+    c4_positions = connect_four_positions(POSITIONS)
+
+    # Both checks must agree before their timings mean anything
+    for board, bitboard, cell, symbol in positions:
+        assert bool(legacy_win_check(board, symbol)) == ttt.wins(bitboard, cell)
+
+    legacy_ns = per_call_ns(lambda: [legacy_win_check(b, s) for b, _, _, s in positions], len(positions))
+    bitboard_ns = per_call_ns(lambda: [ttt.wins(bb, cell) for _, bb, cell, _ in positions], len(positions))
+    c4_ns = per_call_ns(lambda: [c4.wins(bb, 0) for bb in c4_positions], len(c4_positions))
+
+    print("🎲 Game engine benchmark (ns per win check, best of runs)")
+    print(f"  {'tic-tac-toe, legacy sets':<28} {legacy_ns:>8.0f}")
+    print(f"  {'tic-tac-toe, bitboard':<28} {bitboard_ns:>8.0f}  ({legacy_ns / bitboard_ns:.1f}x)")
+    print(f"  {'connect-four, bitboard':<28} {c4_ns:>8.0f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+AstralLink Message Search Benchmark
+Compares text-index search against a regex scan across corpus sizes.
+
+Seeds a scratch database next to the app's (DB_NAME + "_search_bench"),
+so it needs the same MONGO_URL / DB_NAME as backend/.env. The scratch
+database is dropped at the end.
+"""
+
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, ASCENDING, DESCENDING, TEXT
+
+load_dotenv(Path(__file__).parent / "backend" / ".env")
+
+# Configuration
+CORPUS_SIZES = [1_000, 10_000, 100_000]
+CHANNELS = 20
+QUERIES = ["deploy", "meeting notes", "cosmic launch", "bug", "weekend plans"]
+RUNS_PER_QUERY = 5
+
+WORDS = (
+    "the a we should deploy bug fix meeting notes launch cosmic rocket orbit "
+    "weekend plans review merge branch test release coffee lunch standup "
+    "design doc idea ship today tomorrow later please thanks"
+).split()
+
+def seed(collection, size):
+    """Insert `size` synthetic messages spread over a few channels"""
+    collection.drop()
+    collection.create_index([("content", TEXT)])
+    collection.create_index([("channel_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)])
+    start = datetime.now(timezone.utc) - timedelta(days=30)
+    batch = []
+    for i in range(size):
+        batch.append({
+            "id": str(uuid.uuid4()),
+            "channel_id": f"channel-{i % CHANNELS}",
+            "user_id": f"user-{random.randrange(50)}",
+            "content": " ".join(random.choices(WORDS, k=random.randint(4, 20))),
+            "created_at": start + timedelta(seconds=i),
+        })
+        if len(batch) == 5000:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+def time_query(run):
+    samples = []
+    for _ in range(RUNS_PER_QUERY):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def text_search(collection, q):
+    return list(collection.find(
+        {"$text": {"$search": q}, "channel_id": "channel-0"},
+        {"score": {"$meta": "textScore"}}
+    ).sort([("score", {"$meta": "textScore"})]).limit(25))
+
+def regex_scan(collection, q):
+    return list(collection.find(
+        {"content": {"$regex": q, "$options": "i"}, "channel_id": "channel-0"}
+    ).sort("created_at", -1).limit(25))
+
+def main():
+    mongo = MongoClient(os.environ["MONGO_URL"])
+    db_name = os.environ["DB_NAME"] + "_search_bench"
+    collection = mongo[db_name].messages
+
+    print("🔎 Message search benchmark (median ms per query)")
+    print(f"  {'corpus':>8}  {'text index':>10}  {'regex scan':>10}")
+    try:
+        for size in CORPUS_SIZES:
+            seed(collection, size)
+            text_ms = statistics.mean(time_query(lambda: text_search(collection, q)) for q in QUERIES)
+            regex_ms = statistics.mean(time_query(lambda: regex_scan(collection, q)) for q in QUERIES)
+            print(f"  {size:>8}  {text_ms:>10.2f}  {regex_ms:>10.2f}")
+    finally:
+        mongo.drop_database(db_name)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
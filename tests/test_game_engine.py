@@ -0,0 +1,123 @@
+import pytest
+
+import game_engine
+from game_engine import GameError
+
+PLAYERS = ["alice", "bob"]
+C4 = game_engine.get_game_type("connect4")
+
+
+def play_all(game_type, moves, key):
+    state = game_engine.new_state(game_type, PLAYERS)
+    outcome = None
+    for value in moves:
+        outcome = game_engine.play(game_type, state, PLAYERS, state["turn"], {key: value})
+    return state, outcome
+
+
+def c4_bits(*cells):
+    """Bitboard for (column, row) cells, rows counted from the bottom"""
+    return sum(1 << (column * C4.STRIDE + row) for column, row in cells)
+
+
+def test_game_type_is_abstract():
+    with pytest.raises(TypeError):
+        game_engine.GameType()
+
+
+def test_new_state_needs_distinct_players():
+    with pytest.raises(GameError):
+        game_engine.new_state("connect4", ["alice", "alice"])
+    with pytest.raises(GameError):
+        game_engine.new_state("chess", PLAYERS)
+
+
+def test_tictactoe_win():
+    state, outcome = play_all("tictactoe", [0, 3, 1, 4, 2], "cell")
+    assert outcome["winner"] == "alice"
+    assert state["finished"] and state["turn"] is None
+    assert state["board"][:3] == ["X", "X", "X"]
+
+
+def test_tictactoe_draw():
+    state, outcome = play_all("tictactoe", [0, 1, 2, 4, 3, 5, 7, 6, 8], "cell")
+    assert outcome["winner"] is None
+    assert outcome["completed"]
+
+
+def test_connect_four_horizontal_win_at_right_edge():
+    state, outcome = play_all("connect4", [3, 3, 4, 4, 5, 5, 6], "column")
+    assert outcome["winner"] == "alice"
+    assert state["board"][-4:] == ["X"] * 4
+
+
+def test_connect_four_vertical_win():
+    _, outcome = play_all("connect4", [0, 1, 0, 1, 0, 1, 0], "column")
+    assert outcome["winner"] == "alice"
+
+
+def test_connect_four_rising_diagonal_win():
+    _, outcome = play_all("connect4", [0, 1, 1, 2, 2, 3, 2, 3, 3, 6, 3], "column")
+    assert outcome["winner"] == "alice"
+
+
+def test_connect_four_falling_diagonal_win():
+    _, outcome = play_all("connect4", [6, 5, 5, 4, 4, 3, 4, 3, 3, 0, 3], "column")
+    assert outcome["winner"] == "alice"
+
+
+def test_connect_four_lines_do_not_wrap():
+    # Top of one column running into the bottom of the next
+    assert not C4.wins(c4_bits((0, 3), (0, 4), (0, 5), (1, 0)), 0)
+    # Right edge of one row running into the left edge of the next
+    assert not C4.wins(c4_bits((4, 0), (5, 0), (6, 0), (0, 1)), 0)
+    assert C4.wins(c4_bits((3, 0), (4, 0), (5, 0), (6, 0)), 0)
+
+
+def test_connect_four_board_is_drawn_from_the_top():
+    state, _ = play_all("connect4", [2], "column")
+    assert state["board"][5 * C4.WIDTH + 2] == "X"
+
+
+def test_connect_four_full_column():
+    state, _ = play_all("connect4", [0] * C4.HEIGHT, "column")
+    with pytest.raises(GameError, match="Column is full"):
+        game_engine.play("connect4", state, PLAYERS, state["turn"], {"column": 0})
+
+
+@pytest.mark.parametrize("column", [-1, 7, "3", True, None])
+def test_connect_four_invalid_column(column):
+    state = game_engine.new_state("connect4", PLAYERS)
+    with pytest.raises(GameError, match="Invalid column"):
+        game_engine.play("connect4", state, PLAYERS, "alice", {"column": column})
+
+
+def test_not_your_turn():
+    state = game_engine.new_state("connect4", PLAYERS)
+    with pytest.raises(GameError, match="Not your turn"):
+        game_engine.play("connect4", state, PLAYERS, "bob", {"column": 0})
+    with pytest.raises(GameError, match="Not a player"):
+        game_engine.play("connect4", state, PLAYERS, "carol", {"column": 0})
+
+
+def test_no_moves_after_game_over():
+    state, _ = play_all("tictactoe", [0, 3, 1, 4, 2], "cell")
+    with pytest.raises(GameError, match="Game is over"):
+        game_engine.play("tictactoe", state, PLAYERS, "bob", {"cell": 5})
+
+
+def test_tictactoe_occupied_cell():
+    state, _ = play_all("tictactoe", [4], "cell")
+    with pytest.raises(GameError, match="Cell not empty"):
+        game_engine.play("tictactoe", state, PLAYERS, "bob", {"cell": 4})
+
+
+def test_legacy_state_is_rebuilt_from_board():
+    # Saved before bitboards existed; the stored turn is not trusted
+    state = {"board": ["X", "O", None, None, "X", None, None, None, None], "turn": "alice", "history": []}
+    with pytest.raises(GameError, match="Not your turn"):
+        game_engine.play("tictactoe", state, PLAYERS, "alice", {"cell": 8})
+    assert state["bitboards"] == [0b10001, 0b10]
+    outcome = game_engine.play("tictactoe", state, PLAYERS, "bob", {"cell": 8})
+    assert outcome["winner"] is None
+    assert game_engine.play("tictactoe", state, PLAYERS, "alice", {"cell": 6})["turn"] == "bob"
@@ -0,0 +1,31 @@
+import asyncio
+
+import game_engine
+import server
+
+PLAYERS = ["alice", "bob"]
+
+
+def test_queued_writes_keep_their_own_move():
+    hub = server.GameHub(collection=None)
+    game = {
+        "id": "g1",
+        "game_type": "connect4",
+        "player_ids": PLAYERS,
+        "state": game_engine.new_state("connect4", PLAYERS),
+        "completed": False,
+    }
+
+    async def play_two():
+        await hub.play(game, "alice", {"column": 0})
+        await hub.play(game, "bob", {"column": 1})
+
+    asyncio.run(play_two())
+    (_, first), (_, second) = hub.queue.get_nowait(), hub.queue.get_nowait()
+    assert first._filter["state.history"] == {"$size": 0}
+    assert first._doc["$set"]["state.bitboards"] == [1, 0]
+    assert first._doc["$set"]["state.turn"] == "bob"
+    assert second._doc["$set"]["state.bitboards"] == [1, 1 << game_engine.ConnectFour.STRIDE]
+    assert first._doc["$set"]["state.bitboards"] is not game["state"]["bitboards"]
+    assert first._doc["$push"]["state.history"] is not game["state"]["history"][0]
+    assert hub.pending["g1"] == 2
@@ -0,0 +1,154 @@
+import asyncio
+import random
+
+import pytest
+
+import note_ot
+import server
+from server import NoteDeleted, NoteResync, NoteSession
+
+ALPHABET = "abcxyz é😀"
+
+
+def random_op(text: str, rng: random.Random) -> list:
+    op = []
+    position = 0
+    while position < len(text):
+        n = rng.randint(1, len(text) - position)
+        kind = rng.random()
+        if kind < 0.2:
+            op.append("".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 3))))
+        op.append(n if kind < 0.6 else -n)
+        position += n
+    if rng.random() < 0.5:
+        op.append(rng.choice(ALPHABET))
+    return note_ot.normalize(op)
+
+
+def test_apply():
+    assert note_ot.apply("hello", [1, "E", -1, 3, " world"]) == "hEllo world"
+    assert note_ot.apply("", ["abc"]) == "abc"
+    assert note_ot.apply("abc", [-3]) == ""
+
+
+def test_apply_rejects_wrong_length():
+    with pytest.raises(ValueError):
+        note_ot.apply("hello", [4])
+
+
+@pytest.mark.parametrize("op", ["abc", [0], [""], [True], [1.5], [None]])
+def test_validate_rejects(op):
+    with pytest.raises(ValueError):
+        note_ot.validate(op)
+
+
+def test_validate_normalizes():
+    assert note_ot.validate([1, 2, "a", "b", -1, -2, 3]) == [3, "ab", -3, 3]
+
+
+def test_lengths():
+    op = [2, "xyz", -3, 1]
+    assert note_ot.base_length(op) == 6
+    assert note_ot.target_length(op) == 6
+
+
+def test_transform_converges():
+    rng = random.Random(1234)
+    for _ in range(2000):
+        text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 12)))
+        a, b = random_op(text, rng), random_op(text, rng)
+        a2, b2 = note_ot.transform(a, b)
+        assert note_ot.apply(note_ot.apply(text, a), b2) == note_ot.apply(note_ot.apply(text, b), a2)
+
+
+def test_transform_tie_puts_first_insert_first():
+    a, b = [2, "A", 3], [2, "B", 3]
+    a2, b2 = note_ot.transform(a, b)
+    assert note_ot.apply(note_ot.apply("hello", a), b2) == "heABllo"
+    b2, a2 = note_ot.transform(b, a)
+    assert note_ot.apply(note_ot.apply("hello", b), a2) == "heBAllo"
+
+
+def test_transform_overlapping_deletes():
+    a, b = [1, -3, 1], [2, -3]
+    a2, b2 = note_ot.transform(a, b)
+    assert note_ot.apply(note_ot.apply("hello", a), b2) == "h"
+    assert note_ot.apply(note_ot.apply("hello", b), a2) == "h"
+
+
+def test_transform_rejects_different_bases():
+    with pytest.raises(ValueError):
+        note_ot.transform([3], [4])
+
+
+def test_replace_roundtrip():
+    rng = random.Random(99)
+    for _ in range(500):
+        old = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 10)))
+        new = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 10)))
+        assert note_ot.apply(old, note_ot.replace(old, new)) == new
+
+
+def test_replace_keeps_prefix_and_suffix():
+    assert note_ot.replace("hello world", "hello there world") == [6, "there ", 5]
+    assert note_ot.replace("same", "same") == [4]
+
+
+def make_session(content="hello", revision=0):
+    return NoteSession({"id": "n", "server_id": "s", "content": content, "revision": revision})
+
+
+def test_session_rebases_past_accepted_ops():
+    session = make_session()
+    first = [5, " world"]
+    session._record(1, first, note_ot.apply(session.content, first))
+    # Written against revision 0, before " world" was appended
+    rebased = session.rebase([-1, "H", 4], 0)
+    session._record(2, rebased, note_ot.apply(session.content, rebased))
+    assert session.content == "Hello world"
+    assert session.revision == 2
+
+
+def test_session_current_op_is_unchanged():
+    session = make_session()
+    assert session.rebase([5, "!"], 0) == [5, "!"]
+
+
+def test_session_resync_when_base_is_ahead():
+    with pytest.raises(NoteResync):
+        make_session().rebase([5], 1)
+
+
+def test_session_resync_when_history_is_gone():
+    session = make_session(revision=10)
+    session._record(11, [5, "!"], "hello!")
+    session.rebase([5], 10)
+    with pytest.raises(NoteResync):
+        session.rebase([5], 9)
+
+
+def test_closed_session_rejects_ops():
+    session = make_session()
+    session.closed = True
+    with pytest.raises(NoteDeleted):
+        asyncio.run(session.submit([5, "!"], 0, "alice"))
+    assert session.content == "hello"
+
+
+def test_deleted_event_closes_local_session(monkeypatch):
+    closed = []
+
+    async def close(note_id):
+        closed.append(note_id)
+
+    monkeypatch.setattr(server, "close_note_session", close)
+    monkeypatch.setitem(server.note_sessions, "n", make_session())
+
+    async def deliver():
+        server.note_channel_event("note:n", '{"type": "op", "revision": 1, "op": [5]}')
+        server.note_channel_event("note:other", '{"type": "deleted"}')
+        server.note_channel_event("note:n", '{"type": "deleted"}')
+        await asyncio.sleep(0)
+
+    asyncio.run(deliver())
+    assert closed == ["n"]
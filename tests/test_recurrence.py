@@ -0,0 +1,132 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from dateutil.rrule import rrulestr
+from fastapi import HTTPException
+
+import server
+
+START = datetime(2025, 1, 1, 8, 17, tzinfo=timezone.utc)
+DURATION = timedelta(minutes=45)
+
+
+def event(rule, start=START):
+    return {
+        "id": "e", "server_id": "s", "title": "t", "recurrence": rule,
+        "start_time": start, "end_time": start + DURATION,
+        "created_by": "u", "created_at": start,
+    }
+
+
+def expand(rule, window_start, window_end, start=START):
+    return [e.start_time for e in server.expand_occurrences(event(rule, start), window_start, window_end)]
+
+
+def naive(rule, window_start, window_end, start=START):
+    return list(rrulestr(rule, dtstart=start).between(window_start - DURATION, window_end, inc=False))
+
+
+@pytest.mark.parametrize("rule, message", [
+    ("FREQ=DAILY;INTERVAL=0", "interval"),
+    ("FREQ=SECONDLY", "every minute"),
+    ("FREQ=DAILY;COUNT=100000", "COUNT"),
+    ("FREQ=MINUTELY;BYMONTH=2;BYMONTHDAY=30;COUNT=5", "matches no dates"),
+    ("FREQ=MINUTELY;BYMONTH=2;BYMONTHDAY=30", "matches no dates"),
+    ("FREQ=DAILY;BYMONTH=4;BYMONTHDAY=31", "matches no dates"),
+    # Every matching weekday is off the 7-day grid
+    ("FREQ=DAILY;INTERVAL=7;BYDAY=TU", "no occurrence"),
+    ("FREQ=NEVER", "Invalid"),
+])
+def test_rejected_rules_fail_fast(rule, message):
+    began = time.monotonic()
+    with pytest.raises(HTTPException) as error:
+        server.recurrence_end(rule, START, START + DURATION)
+    assert error.value.status_code == 400
+    assert message in error.value.detail
+    assert time.monotonic() - began < 2
+
+
+def test_recurrence_end_with_count():
+    assert server.recurrence_end("FREQ=DAILY;COUNT=3", START, START + DURATION) == START + timedelta(days=2) + DURATION
+
+
+def test_recurrence_end_with_until():
+    end = server.recurrence_end("FREQ=WEEKLY;UNTIL=20250201T000000Z", START, START + DURATION)
+    assert end == START + timedelta(weeks=4) + DURATION
+
+
+def test_recurrence_end_of_rare_series():
+    end = server.recurrence_end("FREQ=YEARLY;BYMONTH=2;BYMONTHDAY=29;COUNT=2", START, START + DURATION)
+    assert end == datetime(2032, 2, 29, 8, 17, tzinfo=timezone.utc) + DURATION
+
+
+def test_open_ended_series():
+    assert server.recurrence_end("FREQ=DAILY", START, START + DURATION) is None
+    # Runs past the horizon
+    assert server.recurrence_end("FREQ=YEARLY;COUNT=50", START, START + DURATION) is None
+    assert server.recurrence_end(None, START, START + DURATION) is None
+
+
+def test_expand_count_series():
+    window = (START - timedelta(days=1), START + timedelta(days=30))
+    assert expand("FREQ=DAILY;COUNT=5", *window) == [START + timedelta(days=n) for n in range(5)]
+
+
+def test_expand_until_series():
+    window = (START, START + timedelta(days=60))
+    assert expand("FREQ=WEEKLY;UNTIL=20250122T000000Z", *window) == [START + timedelta(weeks=n) for n in range(3)]
+
+
+def test_expand_includes_occurrence_overlapping_window_start():
+    occurrences = expand("FREQ=DAILY", START + timedelta(days=3, minutes=30), START + timedelta(days=4))
+    assert occurrences == [START + timedelta(days=3)]
+
+
+@pytest.mark.parametrize("rule", [
+    "FREQ=MINUTELY;INTERVAL=7",
+    "FREQ=HOURLY;INTERVAL=5;BYMINUTE=0,30",
+    "FREQ=WEEKLY;INTERVAL=3;BYDAY=MO,WE,FR",
+    "FREQ=DAILY;INTERVAL=2;BYMONTH=2,3",
+    "FREQ=MONTHLY;BYDAY=-1FR",
+    "FREQ=MINUTELY;INTERVAL=13;BYHOUR=9,10",
+    "FREQ=DAILY;COUNT=400",
+    "FREQ=WEEKLY;BYDAY=TU;UNTIL=20270101T000000Z",
+])
+def test_expansion_matches_dateutil(rule):
+    rng = random.Random(rule)
+    for _ in range(10):
+        window_start = START + timedelta(minutes=rng.randint(-1000, 200000))
+        window_end = window_start + timedelta(days=rng.choice([1, 3, 30]))
+        expected = naive(rule, window_start, window_end)[:server.MAX_OCCURRENCES_PER_SERIES]
+        assert expand(rule, window_start, window_end) == expected
+
+
+def test_expansion_of_old_dense_series_is_cheap():
+    start = datetime(2015, 1, 1, tzinfo=timezone.utc)
+    window_start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    began = time.monotonic()
+    occurrences = expand("FREQ=MINUTELY", window_start, window_start + timedelta(hours=1), start=start)
+    assert time.monotonic() - began < 0.5
+    # The hour's 60 starts plus the 44 earlier ones still running at its start
+    assert len(occurrences) == 104
+    assert occurrences == naive("FREQ=MINUTELY", window_start, window_start + timedelta(hours=1), start=window_start - timedelta(days=1))
+
+
+def test_expansion_is_capped_per_series():
+    window_start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    assert len(expand("FREQ=MINUTELY", window_start, window_start + timedelta(days=30))) == server.MAX_OCCURRENCES_PER_SERIES
+
+
+@pytest.mark.parametrize("rule", ["FREQ=DAILY;INTERVAL=0", "FREQ=MINUTELY;BYMONTH=2;BYMONTHDAY=30", "FREQ=DAILY;INTERVAL=7;BYDAY=TU"])
+def test_invalid_stored_series_expand_to_nothing_quickly(rule):
+    window_start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    began = time.monotonic()
+    assert expand(rule, window_start, window_start + timedelta(days=31)) == []
+    assert time.monotonic() - began < 2
+
+
+def test_window_is_bounded():
+    with pytest.raises(HTTPException):
+        server.parse_window("2026-01-01T00:00:00+00:00", "2030-01-01T00:00:00+00:00")
@@ -0,0 +1,106 @@
+import pytest
+
+import server
+from server import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_get_and_miss():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("b", "default") == "default"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_expire(clock):
+    cache = TTLCache(max_size=10, ttl=30)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=90)
+    clock[0] += 29.9
+    assert cache.get("a") == 1
+    clock[0] += 0.1
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.expirations == 1
+    assert cache.stats()["size"] == 1
+
+
+def test_non_positive_ttl_is_not_stored():
+    cache = TTLCache(max_size=10, ttl=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    TTLCache(max_size=0, ttl=60).set("a", 1)
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_overwrite_does_not_evict():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("a", 3)
+    assert cache.get("a") == 3
+    assert cache.get("b") == 2
+    assert cache.evictions == 0
+
+
+def test_invalidate_tag():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set("s1", "alice", tags=["user:alice"])
+    cache.set("s2", "alice", tags=["user:alice", "server:x"])
+    cache.set("s3", "bob", tags=["user:bob"])
+    cache.invalidate_tag("user:alice")
+    assert cache.get("s1") is None
+    assert cache.get("s2") is None
+    assert cache.get("s3") == "bob"
+    assert cache.invalidations == 2
+    # Removed entries leave no stale tag index behind
+    assert cache._tags == {"user:bob": {"s3"}}
+
+
+def test_retagging_on_overwrite():
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set("k", 1, tags=["old"])
+    cache.set("k", 2, tags=["new"])
+    cache.invalidate_tag("old")
+    assert cache.get("k") == 2
+    cache.invalidate_tag("new")
+    assert cache.get("k") is None
+
+
+def test_evicted_entries_leave_their_tags():
+    cache = TTLCache(max_size=1, ttl=60)
+    cache.set("a", 1, tags=["t"])
+    cache.set("b", 2)
+    assert "t" not in cache._tags
+
+
+def test_stats():
+    cache = TTLCache(max_size=5, ttl=60)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("a")
+    cache.get("missing")
+    stats = cache.stats()
+    assert stats["size"] == 1
+    assert stats["max_size"] == 5
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["hit_ratio"] == round(2 / 3, 4)